@@ -3,16 +3,28 @@ import os
 # 1. main.py content
 main_py = r"""import os
 import logging
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters
+import time
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, TypeHandler, filters
 from telegram import Update
 from handlers import (
+    flood_gate,
+    ban_gate,
     start_handler, 
     admin_panel_handler,
     button_handler,
     message_handler,
-    help_handler
+    help_handler,
+    bulk_handler,
+    clone_handler,
+    snapshot_handler,
+    callback_route
 )
-from database import init_database
+from metrics import instrument_handler, monitor_loop_lag, start_metrics_server, METRICS_PORT, STARTUP_SECONDS
+from database import start_settings_watcher
+from async_database import warm_up, close_database, user_flush_loop, banned_ids_refresh_loop, flush_user_data
+from webhook import serve_webhook
+from clone_host import serve_clone_host
+from broadcast_jobs import start_broadcast_worker, stop_broadcast_worker
 import asyncio
 
 logging.basicConfig(
@@ -21,27 +33,114 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+STARTED_AT = time.perf_counter()
+
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
+BOT_API_URL = os.environ.get('BOT_API_URL')
 MONGO_URI = os.environ.get('MONGO_URI')
 OWNER_ID = int(os.environ.get('OWNER_ID', '0'))
+SETTINGS_WATCH = os.environ.get('SETTINGS_WATCH', '').lower() in ('1', 'true', 'yes')
+CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', '256'))
+BOT_MODE = os.environ.get('BOT_MODE', 'polling').lower()
+DROP_PENDING_UPDATES = os.environ.get('DROP_PENDING_UPDATES', '').lower() in ('1', 'true', 'yes')
+CLONE_HOST = os.environ.get('CLONE_HOST', '').lower() in ('1', 'true', 'yes')
 
 async def keep_alive():
     while True:
         logger.info("Bot is alive and running...")
         await asyncio.sleep(300)
 
-def main():
-    init_database()
-    application = Application.builder().token(BOT_TOKEN).build()
+BACKGROUND_TASKS = ('user_flush_task', 'ban_refresh_task', 'loop_lag_task', 'keep_alive_task')
+
+async def post_init(application):
+    warmup_started = time.perf_counter()
+    ping_seconds = await warm_up()
+    warmup_seconds = time.perf_counter() - warmup_started
+    if SETTINGS_WATCH:
+        start_settings_watcher()
+    application.bot_data['user_flush_task'] = asyncio.create_task(user_flush_loop())
+    application.bot_data['ban_refresh_task'] = asyncio.create_task(banned_ids_refresh_loop())
+    application.bot_data['loop_lag_task'] = asyncio.create_task(monitor_loop_lag())
+    application.bot_data['keep_alive_task'] = asyncio.create_task(keep_alive())
+    application.bot_data['broadcast_worker_task'] = start_broadcast_worker(application)
+    if METRICS_PORT:
+        application.bot_data['metrics_runner'] = await start_metrics_server()
+    total_seconds = time.perf_counter() - STARTED_AT
+    STARTUP_SECONDS.set(ping_seconds, phase="mongo_ping")
+    STARTUP_SECONDS.set(warmup_seconds, phase="warmup")
+    STARTUP_SECONDS.set(total_seconds, phase="total")
+    logger.info("Ready in %.2fs (MongoDB ping %.1f ms, warmup %.2fs)", total_seconds, ping_seconds * 1000, warmup_seconds)
+
+async def post_stop(application):
+    # Application.stop() has already stopped taking updates and awaited every
+    # in-flight handler. Checkpoint the broadcast, stop the loops that could
+    # still buffer or write, then flush what is left.
+    broadcast_worker_task = application.bot_data.pop('broadcast_worker_task', None)
+    if broadcast_worker_task:
+        await stop_broadcast_worker(broadcast_worker_task)
+    tasks = [application.bot_data.pop(task_name, None) for task_name in BACKGROUND_TASKS]
+    tasks = [task for task in tasks if task]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    flushed = await flush_user_data()
+    logger.info("Flushed %d buffered user updates on shutdown", flushed)
+    metrics_runner = application.bot_data.pop('metrics_runner', None)
+    if metrics_runner:
+        await metrics_runner.cleanup()
+
+async def post_shutdown(application):
+    await close_database()
+    logger.info("Shutdown complete")
+
+def make_builder(token):
+    builder = Application.builder().token(token)
+    if BOT_API_URL:
+        builder = builder.base_url(BOT_API_URL)
+    return builder
+
+def build_application(builder=None):
+    if builder is None:
+        builder = make_builder(BOT_TOKEN)
+    application = (
+        builder
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
-    application.add_handler(CommandHandler("start", start_handler))
-    application.add_handler(CommandHandler("admin", admin_panel_handler))
-    application.add_handler(CommandHandler("help", help_handler))
-    application.add_handler(CallbackQueryHandler(button_handler))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
+    application.add_handler(TypeHandler(Update, instrument_handler("flood_gate", flood_gate)), group=-2)
+    application.add_handler(TypeHandler(Update, instrument_handler("ban_gate", ban_gate)), group=-1)
+    application.add_handler(CommandHandler("start", instrument_handler("start", start_handler)))
+    application.add_handler(CommandHandler("admin", instrument_handler("admin", admin_panel_handler)))
+    application.add_handler(CommandHandler("help", instrument_handler("help", help_handler)))
+    application.add_handler(CommandHandler(["ban", "unban", "genkeys"], instrument_handler("bulk", bulk_handler)))
+    application.add_handler(CommandHandler("clone", instrument_handler("clone", clone_handler)))
+    application.add_handler(MessageHandler(
+        filters.Document.ALL & filters.CaptionRegex(r"^/(ban|unban|genkeys)(@\w+)?(\s|$)"),
+        instrument_handler("bulk", bulk_handler)
+    ))
+    application.add_handler(CommandHandler(["export", "import"], instrument_handler("snapshot", snapshot_handler)))
+    application.add_handler(MessageHandler(
+        filters.Document.ALL & filters.CaptionRegex(r"^/import(@\w+)?(\s|$)"),
+        instrument_handler("snapshot", snapshot_handler)
+    ))
+    application.add_handler(CallbackQueryHandler(instrument_handler("callback", button_handler, callback_route)))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrument_handler("message", message_handler)))
+    return application
+
+def main():
+    application = build_application()
     
-    logger.info("Bot started successfully!")
-    application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    logger.info("Starting bot in %s mode", BOT_MODE)
+    if CLONE_HOST:
+        asyncio.run(serve_clone_host(application, build_application, make_builder, drop_pending_updates=DROP_PENDING_UPDATES))
+    elif BOT_MODE == 'webhook':
+        asyncio.run(serve_webhook(application, drop_pending_updates=DROP_PENDING_UPDATES))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=DROP_PENDING_UPDATES)
 
 if __name__ == '__main__':
     main()
@@ -49,81 +148,578 @@ if __name__ == '__main__':
 
 # 2. database.py content
 database_py = r"""import os
-from pymongo import MongoClient
-from datetime import datetime
+import gzip
+import logging
+import zlib
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
+from bson import ObjectId, json_util
+from bson.errors import BSONError
+from datetime import datetime, timedelta
+import contextvars
+import threading
+import time
 import uuid
 
+logger = logging.getLogger(__name__)
+
 MONGO_URI = os.environ.get('MONGO_URI')
-client = MongoClient(MONGO_URI)
-db = client['telegram_bot']
+OWNER_ID = int(os.environ.get('OWNER_ID', '0'))
+MONGO_DB_NAME = os.environ.get('MONGO_DB_NAME', 'telegram_bot')
+TENANT_DB_PREFIX = os.environ.get('TENANT_DB_PREFIX', 'clone_')
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '32'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '4'))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '30000'))
+
+def _make_client(uri):
+    # mongomock:// runs the bot against an in-memory stand-in (benchmarks, local tests).
+    if uri and uri.startswith('mongomock://'):
+        import mongomock
+        return mongomock.MongoClient()
+    # Only DB_POOL_SIZE executor threads (plus the settings watcher) talk to
+    # Mongo at once, so a pool a little larger never makes a call wait for a
+    # socket. The short selection timeout makes a bad URI fail at startup
+    # instead of after pymongo's 30 s default.
+    return MongoClient(
+        uri,
+        connect=False,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS
+    )
+
+_client = None
+_client_lock = threading.Lock()
+_transactions_supported = None
+
+def get_client():
+    # Built on first use so importing this module (benchmarks, the clone host,
+    # tooling) opens no sockets; warm_up() is what normally gets here first.
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _make_client(MONGO_URI)
+    return _client
+
+def close_client():
+    if _client is not None:
+        _client.close()
+
+class Tenant:
+    # One hosted bot: its own database on the shared client plus the in-memory
+    # caches and write buffer that used to be module globals.
+    def __init__(self, name, owner_id, database_name=None):
+        self.name = name
+        self.owner_id = owner_id
+        self.database_name = database_name or TENANT_DB_PREFIX + name
+        self.collections = {}
+        self.settings_cache = {"settings": None, "loaded_at": 0.0}
+        self.banned_ids = set()
+        self.banned_ids_lock = threading.Lock()
+        self.ban_changes = None
+        self.pending_users = {}
+        self.pending_users_lock = threading.Lock()
+        self.write_buffer_metrics = {"flushes": 0, "flushed_users": 0, "errors": 0, "last_flush_seconds": 0.0, "max_flush_seconds": 0.0}
+
+    @property
+    def db(self):
+        return get_client()[self.database_name]
+
+    def collection(self, name):
+        collection = self.collections.get(name)
+        if collection is None:
+            collection = self.collections[name] = self.db[name]
+        return collection
+
+default_tenant = Tenant("default", OWNER_ID, MONGO_DB_NAME)
+_current_tenant = contextvars.ContextVar("tenant", default=default_tenant)
+
+def current_tenant():
+    return _current_tenant.get()
+
+def use_tenant(tenant):
+    return _current_tenant.set(tenant)
+
+def reset_tenant(token):
+    _current_tenant.reset(token)
+
+class TenantCollection:
+    # Stands in for a pymongo collection and resolves to the current tenant's
+    # copy on every call; run_sync carries the tenant into executor threads.
+    # A fixed tenant pins it to one database regardless of context.
+    def __init__(self, name, tenant=None):
+        self.name = name
+        self.tenant = tenant
+
+    def __getattr__(self, attr):
+        return getattr((self.tenant or current_tenant()).collection(self.name), attr)
 
-users_collection = db['users']
-auth_keys_collection = db['auth_keys']
-settings_collection = db['settings']
-banned_users_collection = db['banned_users']
+users_collection = TenantCollection('users')
+auth_keys_collection = TenantCollection('auth_keys')
+settings_collection = TenantCollection('settings')
+banned_users_collection = TenantCollection('banned_users')
+stats_collection = TenantCollection('stats')
+daily_stats_collection = TenantCollection('daily_stats')
+conversation_states_collection = TenantCollection('conversation_states')
+broadcast_jobs_collection = TenantCollection('broadcast_jobs')
+broadcast_log_collection = TenantCollection('broadcast_log')
+tenants_collection = TenantCollection('tenants', default_tenant)
 
 ORIGINAL_BOT_CREATOR_ID = 7504969018
 ORIGINAL_BOT_CREATOR_NAME = "Sam"
 
+DB_BATCH_SIZE = int(os.environ.get('DB_BATCH_SIZE', '1000'))
+ADMIN_PAGE_SIZE = int(os.environ.get('ADMIN_PAGE_SIZE', '10'))
+SETTINGS_CACHE_TTL = float(os.environ.get('SETTINGS_CACHE_TTL', '60'))
+USER_FLUSH_INTERVAL = float(os.environ.get('USER_FLUSH_INTERVAL', '2'))
+USER_FLUSH_SIZE = int(os.environ.get('USER_FLUSH_SIZE', '500'))
+BAN_CACHE_TTL = float(os.environ.get('BAN_CACHE_TTL', '30'))
+BROADCAST_LEASE_SECONDS = float(os.environ.get('BROADCAST_LEASE_SECONDS', '60'))
+BROADCAST_LOG_TTL = int(os.environ.get('BROADCAST_LOG_TTL', str(7 * 24 * 3600)))
+
+INDEX_SPECS = [
+    ("users", [("user_id", ASCENDING)], {"unique": True}),
+    ("users", [("is_banned", ASCENDING), ("_id", ASCENDING)], {}),
+    ("users", [("last_seen", ASCENDING)], {}),
+    ("auth_keys", [("auth_key", ASCENDING)], {"unique": True}),
+    ("auth_keys", [("is_revoked", ASCENDING), ("_id", ASCENDING)], {}),
+    ("auth_keys", [("is_used", ASCENDING), ("is_revoked", ASCENDING), ("_id", ASCENDING)], {}),
+    ("banned_users", [("user_id", ASCENDING)], {}),
+    ("conversation_states", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ("broadcast_jobs", [("status", ASCENDING), ("_id", ASCENDING)], {}),
+    ("broadcast_log", [("job_id", ASCENDING), ("result", ASCENDING)], {}),
+    ("broadcast_log", [("logged_at", ASCENDING)], {"expireAfterSeconds": BROADCAST_LOG_TTL}),
+]
+
+def ensure_indexes(target_db=None):
+    target_db = current_tenant().db if target_db is None else target_db
+    for collection_name, keys, options in INDEX_SPECS:
+        try:
+            target_db[collection_name].create_index(keys, **options)
+        except OperationFailure as e:
+            # Usually a unique index over data that already holds duplicates;
+            # keep starting up and leave the cleanup to the operator.
+            logger.error("Could not create index %s on %s: %s", keys, collection_name, e)
+
+def describe_indexes(target_db=None):
+    target_db = current_tenant().db if target_db is None else target_db
+    collection_names = sorted({collection_name for collection_name, _, _ in INDEX_SPECS})
+    return {name: sorted(target_db[name].index_information()) for name in collection_names}
+
+def iter_document_batches(collection, query, projection=None, batch_size=None, after_id=None):
+    # Keyset paging on _id: every batch is a fresh indexed range query, so a
+    # consumer can resume from the last _id it saw and memory stays at one batch.
+    batch_size = batch_size or DB_BATCH_SIZE
+    while True:
+        page_query = dict(query)
+        if after_id is not None:
+            page_query["_id"] = {"$gt": after_id}
+        batch = list(collection.find(page_query, projection).sort("_id", 1).limit(batch_size))
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        after_id = batch[-1]["_id"]
+
+def iter_documents(collection, query, projection=None, batch_size=None, after_id=None):
+    for batch in iter_document_batches(collection, query, projection, batch_size, after_id):
+        yield from batch
+
+def get_page(collection, query, projection=None, after=None, before=None, page_size=None):
+    # One bounded range query per page: walk forward from the last _id shown or
+    # backward from the first one, fetching a single extra row to know whether
+    # there is anything beyond this page.
+    page_size = page_size or ADMIN_PAGE_SIZE
+    page_query = dict(query)
+    if before is not None:
+        page_query["_id"] = {"$lt": ObjectId(before)}
+        items = list(collection.find(page_query, projection).sort("_id", -1).limit(page_size + 1))
+        has_prev = len(items) > page_size
+        items = items[:page_size][::-1]
+        has_next = True
+    else:
+        if after is not None:
+            page_query["_id"] = {"$gt": ObjectId(after)}
+        items = list(collection.find(page_query, projection).sort("_id", 1).limit(page_size + 1))
+        has_next = len(items) > page_size
+        items = items[:page_size]
+        has_prev = after is not None
+    return {
+        "items": items,
+        "has_prev": has_prev,
+        "has_next": has_next,
+        "first_id": str(items[0]["_id"]) if items else after,
+        "last_id": str(items[-1]["_id"]) if items else before
+    }
+
 def init_database():
+    ensure_indexes()
+    for collection_name, index_names in describe_indexes().items():
+        logger.info("Indexes on %s: %s", collection_name, ", ".join(index_names))
     if not settings_collection.find_one({"_id": "config"}):
         settings_collection.insert_one({
             "_id": "config",
             "backup_button": None,
             "pricing_details": None
         })
+    if not stats_collection.find_one({"_id": "users"}):
+        rebuild_user_stats()
+    _load_settings()
+    load_banned_ids()
 
-def get_user_data(user_id):
-    return users_collection.find_one({"user_id": user_id})
+def warm_up():
+    # Run once before the first update: connect and prove the server answers,
+    # then build indexes and fill the settings and ban caches so no early
+    # handler pays for any of it.
+    started = time.perf_counter()
+    get_client().admin.command('ping')
+    ping_seconds = time.perf_counter() - started
+    init_database()
+    return ping_seconds
 
-def save_user_data(user_id, username, first_name):
-    users_collection.update_one(
-        {"user_id": user_id},
+def rebuild_user_stats():
+    stats_collection.replace_one(
+        {"_id": "users"},
         {
-            "$set": {
-                "user_id": user_id,
-                "username": username,
-                "first_name": first_name,
-                "last_seen": datetime.now()
-            },
-            "$setOnInsert": {
-                "joined_date": datetime.now(),
-                "is_banned": False
-            }
+            "total": users_collection.count_documents({}),
+            "banned": users_collection.count_documents({"is_banned": True})
         },
         upsert=True
     )
+    joined_per_day = users_collection.aggregate([
+        {"$match": {"joined_date": {"$type": "date"}}},
+        {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$joined_date"}}, "new_users": {"$sum": 1}}}
+    ])
+    for day in joined_per_day:
+        daily_stats_collection.replace_one({"_id": day["_id"]}, {"new_users": day["new_users"]}, upsert=True)
+
+def _increment_user_stats(total=0, banned=0):
+    stats_collection.update_one(
+        {"_id": "users"},
+        {"$inc": {"total": total, "banned": banned}},
+        upsert=True
+    )
 
-def get_all_users():
-    return list(users_collection.find({}))
+def get_user_stats(days=7):
+    counters = stats_collection.find_one({"_id": "users"}) or {}
+    now = datetime.now()
+    new_users_per_day = [
+        (day["_id"], day.get("new_users", 0))
+        for day in daily_stats_collection.find().sort("_id", -1).limit(days)
+    ]
+    return {
+        "total_users": counters.get("total", 0),
+        "banned_users": counters.get("banned", 0),
+        "active_24h": users_collection.count_documents({"last_seen": {"$gte": now - timedelta(days=1)}}),
+        "active_7d": users_collection.count_documents({"last_seen": {"$gte": now - timedelta(days=7)}}),
+        "new_users_per_day": new_users_per_day
+    }
 
-def ban_user(user_id):
-    users_collection.update_one(
-        {"user_id": user_id},
+def get_user_data(user_id):
+    return users_collection.find_one({"user_id": user_id})
+
+def buffer_user_data(user_id, username, first_name):
+    # Later updates for the same user overwrite earlier ones, so a burst of
+    # /start from one user costs a single upsert at the next flush.
+    tenant = current_tenant()
+    with tenant.pending_users_lock:
+        tenant.pending_users[user_id] = (username, first_name, datetime.now())
+        return len(tenant.pending_users)
+
+def save_user_data(user_id, username, first_name):
+    if buffer_user_data(user_id, username, first_name) >= USER_FLUSH_SIZE:
+        flush_user_data()
+
+def flush_user_data():
+    tenant = current_tenant()
+    with tenant.pending_users_lock:
+        if not tenant.pending_users:
+            return 0
+        pending = list(tenant.pending_users.items())
+        tenant.pending_users.clear()
+    started = time.perf_counter()
+    operations = [
+        UpdateOne(
+            {"user_id": user_id},
+            {
+                "$set": {
+                    "user_id": user_id,
+                    "username": username,
+                    "first_name": first_name,
+                    "last_seen": seen_at,
+                    "is_blocked": False
+                },
+                "$setOnInsert": {
+                    "joined_date": seen_at,
+                    "is_banned": False
+                }
+            },
+            upsert=True
+        )
+        for user_id, (username, first_name, seen_at) in pending
+    ]
+    failed = []
+    error = None
+    try:
+        inserted = len(users_collection.bulk_write(operations, ordered=False).upserted_ids)
+    except BulkWriteError as e:
+        # The rest of an unordered batch is written anyway. Count its upserts
+        # now, since on retry those users would only match; requeue just the
+        # failed entries. A duplicate key means another replica inserted the
+        # user first (and counted it), so the retry is a plain update.
+        inserted = len(e.details.get("upserted", []))
+        failed = [pending[write_error["index"]] for write_error in e.details["writeErrors"]]
+        if any(write_error["code"] != 11000 for write_error in e.details["writeErrors"]):
+            error = e
+    except PyMongoError:
+        _requeue_users(tenant, pending)
+        tenant.write_buffer_metrics["errors"] += 1
+        raise
+    if failed:
+        _requeue_users(tenant, failed)
+        tenant.write_buffer_metrics["errors"] += 1
+    if inserted:
+        _increment_user_stats(total=inserted)
+        daily_stats_collection.update_one(
+            {"_id": datetime.now().strftime("%Y-%m-%d")},
+            {"$inc": {"new_users": inserted}},
+            upsert=True
+        )
+    elapsed = time.perf_counter() - started
+    metrics = tenant.write_buffer_metrics
+    metrics["flushes"] += 1
+    metrics["flushed_users"] += len(pending) - len(failed)
+    metrics["last_flush_seconds"] = elapsed
+    metrics["max_flush_seconds"] = max(metrics["max_flush_seconds"], elapsed)
+    if error is not None:
+        raise error
+    return len(pending) - len(failed)
+
+def _requeue_users(tenant, entries):
+    # Newer activity buffered since the flush started wins over the requeued copy.
+    with tenant.pending_users_lock:
+        for user_id, values in entries:
+            tenant.pending_users.setdefault(user_id, values)
+
+def get_write_buffer_metrics():
+    tenant = current_tenant()
+    with tenant.pending_users_lock:
+        depth = len(tenant.pending_users)
+    return {**tenant.write_buffer_metrics, "depth": depth}
+
+def iter_users(projection=None, batch_size=None, after_id=None):
+    return iter_documents(users_collection, {}, projection, batch_size, after_id)
+
+RECIPIENT_QUERY = {"is_banned": False, "is_blocked": {"$ne": True}}
+
+def iter_recipient_ids(batch_size=None, after_id=None):
+    for user in iter_documents(users_collection, RECIPIENT_QUERY, {"user_id": 1}, batch_size, after_id):
+        yield user['user_id']
+
+def iter_recipients(batch_size=None, after_id=None):
+    for user in iter_documents(users_collection, RECIPIENT_QUERY, {"user_id": 1}, batch_size, after_id):
+        yield user['_id'], user['user_id']
+
+def ban_users(user_ids):
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return 0
+    result = users_collection.update_many(
+        {"user_id": {"$in": user_ids}, "is_banned": {"$ne": True}},
         {"$set": {"is_banned": True}}
     )
-    banned_users_collection.insert_one({
-        "user_id": user_id,
-        "banned_at": datetime.now()
-    })
+    if result.modified_count:
+        _increment_user_stats(banned=result.modified_count)
+    now = datetime.now()
+    banned_users_collection.bulk_write([
+        UpdateOne({"user_id": user_id}, {"$setOnInsert": {"user_id": user_id, "banned_at": now}}, upsert=True)
+        for user_id in user_ids
+    ], ordered=False)
+    _record_ban_change(True, user_ids)
+    return result.modified_count
 
-def unban_user(user_id):
-    users_collection.update_one(
-        {"user_id": user_id},
+def unban_users(user_ids):
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return 0
+    result = users_collection.update_many(
+        {"user_id": {"$in": user_ids}, "is_banned": True},
         {"$set": {"is_banned": False}}
     )
-    banned_users_collection.delete_one({"user_id": user_id})
+    if result.modified_count:
+        _increment_user_stats(banned=-result.modified_count)
+    banned_users_collection.delete_many({"user_id": {"$in": user_ids}})
+    _record_ban_change(False, user_ids)
+    return result.modified_count
+
+# Collections a snapshot covers, each with the field that identifies a row
+# across databases (_id does not survive a move to another tenant).
+SNAPSHOT_COLLECTIONS = {"users": "user_id", "auth_keys": "auth_key", "banned_users": "user_id"}
+
+def export_snapshot(fileobj, collection_names=None):
+    # Gzipped NDJSON, one {"collection", "document"} object per line, written
+    # batch by batch from keyset-paged reads so memory stays at one batch.
+    counts = {}
+    with gzip.GzipFile(fileobj=fileobj, mode="wb") as stream:
+        for name in collection_names or SNAPSHOT_COLLECTIONS:
+            counts[name] = 0
+            for batch in iter_document_batches(current_tenant().collection(name), {}):
+                stream.write("".join(json_util.dumps({"collection": name, "document": document}) + "\n" for document in batch).encode())
+                counts[name] += len(batch)
+    return counts
+
+def _import_batch(name, documents, counts):
+    key = SNAPSHOT_COLLECTIONS[name]
+    unique = {}
+    for document in documents:
+        document.pop("_id", None)
+        unique.setdefault(document[key], document)
+    collection = current_tenant().collection(name)
+    existing = {document[key] for document in collection.find({key: {"$in": list(unique)}}, {key: 1})}
+    fresh = [document for value, document in unique.items() if value not in existing]
+    inserted = 0
+    if fresh:
+        try:
+            inserted = len(collection.insert_many(fresh, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            # A unique index caught rows written since the lookup above.
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            inserted = e.details["nInserted"]
+    counts["inserted"] += inserted
+    counts["skipped"] += len(documents) - inserted
+
+def _importable(document, key):
+    if not isinstance(document, dict) or document.get(key) is None:
+        return False
+    try:
+        hash(document[key])
+    except TypeError:
+        return False
+    return True
+
+def import_snapshot(fileobj):
+    # Rows whose user_id/auth_key already exists are skipped, never overwritten,
+    # so a snapshot can be loaded into a live tenant or imported twice.
+    # Batches are written as they fill, so a damaged or cut-off file still
+    # leaves the rows before the damage in place; complete=False tells the
+    # caller, and the stats and ban cache are rebuilt whatever happened.
+    counts = {name: {"inserted": 0, "skipped": 0} for name in SNAPSHOT_COLLECTIONS}
+    batches = {name: [] for name in SNAPSHOT_COLLECTIONS}
+    invalid = 0
+    complete = True
+    try:
+        try:
+            with gzip.GzipFile(fileobj=fileobj, mode="rb") as stream:
+                for line in stream:
+                    if not line.strip():
+                        continue
+                    # json_util raises a different error for each malformed
+                    # $-type; any of them just makes this one line unreadable.
+                    try:
+                        row = json_util.loads(line)
+                    except (ValueError, TypeError, LookupError, BSONError):
+                        invalid += 1
+                        continue
+                    name = row.get("collection") if isinstance(row, dict) else None
+                    if name not in batches or not _importable(row.get("document"), SNAPSHOT_COLLECTIONS[name]):
+                        invalid += 1
+                        continue
+                    batch = batches[name]
+                    batch.append(row["document"])
+                    if len(batch) >= DB_BATCH_SIZE:
+                        _import_batch(name, batch, counts[name])
+                        batch.clear()
+        except (OSError, EOFError, zlib.error):
+            complete = False
+        for name, batch in batches.items():
+            if batch:
+                _import_batch(name, batch, counts[name])
+    finally:
+        if counts["users"]["inserted"] or counts["banned_users"]["inserted"]:
+            rebuild_user_stats()
+            load_banned_ids()
+    return counts, invalid, complete
+
+def ban_user(user_id):
+    return ban_users([user_id])
+
+def unban_user(user_id):
+    return unban_users([user_id])
+
+def _record_ban_change(banned, user_ids):
+    tenant = current_tenant()
+    with tenant.banned_ids_lock:
+        if banned:
+            tenant.banned_ids.update(user_ids)
+        else:
+            tenant.banned_ids.difference_update(user_ids)
+        if tenant.ban_changes is not None:
+            tenant.ban_changes.append((banned, user_ids))
+
+def load_banned_ids(reload=False):
+    # Also run every BAN_CACHE_TTL seconds so bans made by other replicas reach
+    # this one. Bans made here while it reads may be missing from the result,
+    # so they are recorded meanwhile and replayed on top.
+    tenant = current_tenant()
+    with tenant.banned_ids_lock:
+        tenant.ban_changes = []
+    banned_ids = set()
+    try:
+        for user in iter_documents(users_collection, {"is_banned": True}, {"user_id": 1}):
+            banned_ids.add(user['user_id'])
+        for user in iter_documents(banned_users_collection, {}, {"user_id": 1}):
+            banned_ids.add(user['user_id'])
+    except BaseException:
+        with tenant.banned_ids_lock:
+            tenant.ban_changes = None
+        raise
+    with tenant.banned_ids_lock:
+        for banned, user_ids in tenant.ban_changes:
+            if banned:
+                banned_ids.update(user_ids)
+            else:
+                banned_ids.difference_update(user_ids)
+        tenant.ban_changes = None
+        tenant.banned_ids = banned_ids
+    logger.log(logging.DEBUG if reload else logging.INFO, "Loaded %d banned users into memory for %s", len(banned_ids), tenant.name)
 
 def is_user_banned(user_id):
-    user = get_user_data(user_id)
-    return user and user.get('is_banned', False)
+    return user_id in current_tenant().banned_ids
 
-def get_banned_users():
-    return list(users_collection.find({"is_banned": True}))
+def iter_banned_users(batch_size=None, after_id=None):
+    return iter_documents(users_collection, {"is_banned": True}, {"user_id": 1, "first_name": 1}, batch_size, after_id)
 
-def generate_auth_key(purchaser_id, purchaser_name):
-    auth_key = str(uuid.uuid4())
-    auth_keys_collection.insert_one({
+def get_banned_users_page(after=None, before=None, page_size=None):
+    return get_page(users_collection, {"is_banned": True}, {"user_id": 1, "first_name": 1}, after, before, page_size)
+
+def run_in_transaction(callback):
+    # Standalone mongod and mongomock have no transactions. Callers must stay
+    # correct without one, so each starts with a conditional single-document write.
+    global _transactions_supported
+    if _transactions_supported is None:
+        _transactions_supported = isinstance(get_client(), MongoClient)
+    if _transactions_supported:
+        try:
+            with get_client().start_session() as session:
+                return session.with_transaction(callback)
+        except OperationFailure as e:
+            if e.code != 20:
+                raise
+            _transactions_supported = False
+            logger.info("MongoDB deployment does not support transactions, running without them")
+    return callback(None)
+
+def _auth_key_document(auth_key, purchaser_id, purchaser_name):
+    return {
         "auth_key": auth_key,
         "purchaser_id": purchaser_id,
         "purchaser_name": purchaser_name,
@@ -132,393 +728,778 @@ def generate_auth_key(purchaser_id, purchaser_name):
         "used_by": None,
         "used_at": None,
         "is_revoked": False
-    })
+    }
+
+def generate_auth_key(purchaser_id, purchaser_name):
+    auth_key = str(uuid.uuid4())
+    auth_keys_collection.insert_one(_auth_key_document(auth_key, purchaser_id, purchaser_name))
     return auth_key
 
+def generate_auth_keys(purchasers):
+    documents = [_auth_key_document(str(uuid.uuid4()), purchaser_id, purchaser_name) for purchaser_id, purchaser_name in purchasers]
+    if documents:
+        auth_keys_collection.insert_many(documents, ordered=False)
+    return [document["auth_key"] for document in documents]
+
 def verify_auth_key(auth_key):
     key_data = auth_keys_collection.find_one({"auth_key": auth_key, "is_revoked": False})
     if key_data and not key_data.get('is_used', False):
         return key_data
     return None
 
-def mark_auth_key_used(auth_key, user_id):
-    auth_keys_collection.update_one(
-        {"auth_key": auth_key},
-        {
-            "$set": {
-                "is_used": True,
-                "used_by": user_id,
-                "used_at": datetime.now()
-            }
-        }
+def redeem_auth_key(auth_key, user_id, session=None):
+    # The used/revoked checks live in the filter, so of any number of concurrent
+    # redeemers exactly one gets the key document back.
+    return auth_keys_collection.find_one_and_update(
+        {"auth_key": auth_key, "is_used": False, "is_revoked": False},
+        {"$set": {"is_used": True, "used_by": user_id, "used_at": datetime.now()}},
+        session=session
     )
 
+def mark_auth_key_used(auth_key, user_id):
+    return redeem_auth_key(auth_key, user_id) is not None
+
 def revoke_auth_key(auth_key):
-    key_data = auth_keys_collection.find_one({"auth_key": auth_key})
-    if key_data:
-        auth_keys_collection.update_one(
-            {"auth_key": auth_key},
-            {"$set": {"is_revoked": True, "revoked_at": datetime.now()}}
+    new_key = str(uuid.uuid4())
+
+    def revoke_and_reissue(session):
+        key_data = auth_keys_collection.find_one_and_update(
+            {"auth_key": auth_key, "is_revoked": False},
+            {"$set": {"is_revoked": True, "revoked_at": datetime.now(), "replaced_by": new_key}},
+            projection={"purchaser_id": 1, "purchaser_name": 1},
+            session=session
+        )
+        if key_data is None:
+            return None
+        tenants_collection.update_many({"auth_key": auth_key, "active": True}, {"$set": {"active": False}}, session=session)
+        auth_keys_collection.insert_one(
+            _auth_key_document(new_key, key_data['purchaser_id'], key_data['purchaser_name']),
+            session=session
         )
-        new_key = generate_auth_key(key_data['purchaser_id'], key_data['purchaser_name'])
         return new_key
-    return None
 
-def get_all_auth_keys():
-    return list(auth_keys_collection.find({"is_revoked": False}))
+    return run_in_transaction(revoke_and_reissue)
 
-def get_cloners_list():
-    return list(auth_keys_collection.find({"is_used": True, "is_revoked": False}))
+def redeem_clone(auth_key, user_id, bot_token):
+    # Tenants are named after the bot id in the token, so redeeming a second key
+    # for the same bot replaces its token and owner instead of adding a tenant.
+    name = bot_token.split(":", 1)[0]
 
-def get_backup_button():
-    settings = settings_collection.find_one({"_id": "config"})
-    return settings.get('backup_button') if settings else None
+    def redeem_and_register(session):
+        if redeem_auth_key(auth_key, user_id, session=session) is None:
+            return None
+        now = datetime.now()
+        tenants_collection.update_one(
+            {"_id": name},
+            {
+                "$set": {"bot_token": bot_token, "owner_id": user_id, "auth_key": auth_key, "active": True, "error": None, "updated_at": now},
+                "$setOnInsert": {"created_at": now}
+            },
+            upsert=True,
+            session=session
+        )
+        return name
 
-def set_backup_button(link):
-    settings_collection.update_one(
-        {"_id": "config"},
-        {"$set": {"backup_button": link}},
+    return run_in_transaction(redeem_and_register)
+
+def list_active_tenants():
+    return list(tenants_collection.find({"active": True}, {"bot_token": 1, "owner_id": 1}))
+
+def deactivate_tenant(name, error=None):
+    tenants_collection.update_one({"_id": name}, {"$set": {"active": False, "error": error, "updated_at": datetime.now()}})
+
+def iter_auth_keys(batch_size=None, after_id=None):
+    projection = {"auth_key": 1, "purchaser_id": 1, "purchaser_name": 1, "created_at": 1, "is_used": 1}
+    return iter_documents(auth_keys_collection, {"is_revoked": False}, projection, batch_size, after_id)
+
+def iter_cloners(batch_size=None, after_id=None):
+    projection = {"auth_key": 1, "purchaser_id": 1, "purchaser_name": 1, "used_at": 1}
+    return iter_documents(auth_keys_collection, {"is_used": True, "is_revoked": False}, projection, batch_size, after_id)
+
+def get_auth_keys_page(after=None, before=None, page_size=None):
+    projection = {"auth_key": 1, "purchaser_id": 1, "purchaser_name": 1, "created_at": 1, "is_used": 1}
+    return get_page(auth_keys_collection, {"is_revoked": False}, projection, after, before, page_size)
+
+def get_cloners_page(after=None, before=None, page_size=None):
+    projection = {"auth_key": 1, "purchaser_id": 1, "purchaser_name": 1, "used_at": 1}
+    return get_page(auth_keys_collection, {"is_used": True, "is_revoked": False}, projection, after, before, page_size)
+
+def create_broadcast_job(text, progress_chat_id=None, progress_message_id=None):
+    now = datetime.utcnow()
+    return broadcast_jobs_collection.insert_one({
+        "text": text,
+        "status": "queued",
+        "cursor": None,
+        "sent": 0,
+        "failed": 0,
+        "blocked": 0,
+        "progress_chat_id": progress_chat_id,
+        "progress_message_id": progress_message_id,
+        "lease_expires": None,
+        "created_at": now,
+        "updated_at": now
+    }).inserted_id
+
+def claim_broadcast_job():
+    # A running job whose lease ran out belongs to a process that died mid-send;
+    # whoever claims it next resumes from its cursor.
+    now = datetime.utcnow()
+    return broadcast_jobs_collection.find_one_and_update(
+        {"$or": [{"status": "queued"}, {"status": "running", "lease_expires": {"$lt": now}}]},
+        {"$set": {"status": "running", "lease_expires": now + timedelta(seconds=BROADCAST_LEASE_SECONDS), "updated_at": now}},
+        sort=[("_id", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def checkpoint_broadcast_job(job_id, cursor, outcomes, status="running"):
+    # outcomes is a list of (user_id, result) since the last checkpoint. Returns
+    # the job afterwards; a status other than running means the admin paused or
+    # cancelled it and the sender should stop. Successful sends only bump the
+    # job's counters; the log keeps failures, and only for BROADCAST_LOG_TTL.
+    now = datetime.utcnow()
+    increments = {}
+    if outcomes:
+        failures = [{"job_id": job_id, "user_id": user_id, "result": result, "logged_at": now} for user_id, result in outcomes if result != "sent"]
+        if failures:
+            broadcast_log_collection.insert_many(failures, ordered=False)
+        blocked_ids = [user_id for user_id, result in outcomes if result == "blocked"]
+        if blocked_ids:
+            users_collection.update_many({"user_id": {"$in": blocked_ids}}, {"$set": {"is_blocked": True}})
+        sent = sum(1 for _, result in outcomes if result == "sent")
+        increments = {"sent": sent, "failed": len(outcomes) - sent, "blocked": len(blocked_ids)}
+
+    def progress_update(fields):
+        update = {"$set": {"cursor": cursor, "updated_at": now, **fields}}
+        if increments:
+            update["$inc"] = increments
+        return update
+
+    if status == "running":
+        fields = {"lease_expires": now + timedelta(seconds=BROADCAST_LEASE_SECONDS)}
+    else:
+        fields = {"status": status, "lease_expires": None}
+        if status == "done":
+            fields["finished_at"] = now
+    job = broadcast_jobs_collection.find_one_and_update(
+        {"_id": job_id, "status": "running"},
+        progress_update(fields),
+        return_document=ReturnDocument.AFTER
+    )
+    if job is None:
+        job = broadcast_jobs_collection.find_one_and_update({"_id": job_id}, progress_update({}), return_document=ReturnDocument.AFTER)
+    return job
+
+def set_broadcast_status(job_id, status, from_statuses):
+    return broadcast_jobs_collection.find_one_and_update(
+        {"_id": ObjectId(job_id), "status": {"$in": list(from_statuses)}},
+        {"$set": {"status": status, "updated_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+
+def get_active_broadcast_jobs(limit=10):
+    return list(
+        broadcast_jobs_collection.find({"status": {"$in": ["queued", "running", "paused"]}}, {"text": 0})
+        .sort("_id", DESCENDING).limit(limit)
+    )
+
+def get_conversation_state(user_id):
+    # The TTL monitor only runs once a minute, so also filter on expires_at.
+    entry = conversation_states_collection.find_one({"_id": user_id, "expires_at": {"$gt": datetime.utcnow()}})
+    return entry['state'] if entry else None
+
+def set_conversation_state(user_id, state, ttl):
+    conversation_states_collection.replace_one(
+        {"_id": user_id},
+        {"state": state, "expires_at": datetime.utcnow() + timedelta(seconds=ttl)},
         upsert=True
     )
 
-def remove_backup_button():
+def delete_conversation_state(user_id):
+    conversation_states_collection.delete_one({"_id": user_id})
+
+def _load_settings():
+    settings = settings_collection.find_one({"_id": "config"}) or {}
+    cache = current_tenant().settings_cache
+    cache["settings"] = settings
+    cache["loaded_at"] = time.monotonic()
+    return settings
+
+def settings_cached():
+    cache = current_tenant().settings_cache
+    if cache["settings"] is None:
+        return False
+    return SETTINGS_CACHE_TTL <= 0 or time.monotonic() - cache["loaded_at"] < SETTINGS_CACHE_TTL
+
+def get_settings():
+    if settings_cached():
+        return current_tenant().settings_cache["settings"]
+    return _load_settings()
+
+def invalidate_settings_cache():
+    current_tenant().settings_cache["settings"] = None
+
+def _update_settings(fields):
     settings_collection.update_one(
         {"_id": "config"},
-        {"$set": {"backup_button": None}},
+        {"$set": fields},
         upsert=True
     )
+    cache = current_tenant().settings_cache
+    if cache["settings"] is not None:
+        cache["settings"] = {**cache["settings"], **fields}
+
+def watch_settings():
+    # Needs a replica set; other replicas' writes then show up here at once
+    # instead of after SETTINGS_CACHE_TTL.
+    try:
+        with settings_collection.watch([{"$match": {"documentKey._id": "config"}}]) as stream:
+            for _ in stream:
+                invalidate_settings_cache()
+    except PyMongoError as e:
+        logger.warning("Settings change stream stopped, relying on TTL only: %s", e)
+
+def start_settings_watcher():
+    thread = threading.Thread(target=watch_settings, name="settings-watcher", daemon=True)
+    thread.start()
+    return thread
+
+def get_backup_button():
+    return get_settings().get('backup_button')
+
+def set_backup_button(link):
+    _update_settings({"backup_button": link})
+
+def remove_backup_button():
+    _update_settings({"backup_button": None})
 
 def get_pricing_details():
-    settings = settings_collection.find_one({"_id": "config"})
-    return settings.get('pricing_details') if settings else None
+    return get_settings().get('pricing_details')
 
 def set_pricing_details(details):
-    settings_collection.update_one(
-        {"_id": "config"},
-        {"$set": {"pricing_details": details}},
-        upsert=True
-    )
+    _update_settings({"pricing_details": details})
 
 def remove_pricing_details():
-    settings_collection.update_one(
-        {"_id": "config"},
-        {"$set": {"pricing_details": None}},
-        upsert=True
-    )
+    _update_settings({"pricing_details": None})
 """
 
 # 3. handlers.py content
 handlers_py = r"""import os
+import csv
+import io
+import re
+import tempfile
+import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes
-from database import *
+from telegram.ext import ContextTypes, ApplicationHandlerStop
+from bson.errors import BSONError
+from pymongo.errors import PyMongoError
+from async_database import *
+from state_store import create_state_store
+from flood_control import FloodControl
+from metrics import THROTTLED_UPDATES
+from render import *
 
-OWNER_ID = int(os.environ.get('OWNER_ID', '0'))
+BULK_MAX_FILE_SIZE = int(os.environ.get('BULK_MAX_FILE_SIZE', str(1024 * 1024)))
+SNAPSHOT_MAX_FILE_SIZE = int(os.environ.get('SNAPSHOT_MAX_FILE_SIZE', str(20 * 1024 * 1024)))
 
-user_states = {}
+CLONE_TOKEN_PATTERN = re.compile(r"^\d+:[A-Za-z0-9_-]{30,}$")
 
-async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+conversation_states = create_state_store()
+flood_control = FloodControl()
+
+def owner_id():
+    return current_tenant().owner_id
+
+async def flood_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Runs ahead of ban_gate so a spamming client is turned away before any
+    # ban check, upsert or settings read.
     user = update.effective_user
-    
-    if is_user_banned(user.id):
-        await update.message.reply_text("❌ You are banned from using this bot.")
+    if user is None or user.id == owner_id():
         return
+    query = update.callback_query
+    if query:
+        message_key = query.message.message_id if query.message else query.inline_message_id
+        if flood_control.is_repeat_tap(user.id, message_key, query.data):
+            THROTTLED_UPDATES.inc(reason="repeat_tap")
+            await query.answer()
+            raise ApplicationHandlerStop
+    if not flood_control.allow(user.id):
+        THROTTLED_UPDATES.inc(reason="rate_limit")
+        if query:
+            await query.answer("⏳ Too many requests, please slow down.")
+        raise ApplicationHandlerStop
+
+async def ban_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if user is None or not await is_user_banned(user.id):
+        return
+    if update.callback_query:
+        await update.callback_query.answer("❌ You are banned from using this bot.", show_alert=True)
+    elif update.message and update.message.text and update.message.text.startswith('/'):
+        await update.message.reply_text("❌ You are banned from using this bot.")
+    raise ApplicationHandlerStop
+
+async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
     
-    save_user_data(user.id, user.username, user.first_name)
-    
-    owner_data = get_user_data(OWNER_ID)
-    if OWNER_ID == ORIGINAL_BOT_CREATOR_ID:
-        bot_owner_name = ORIGINAL_BOT_CREATOR_NAME
-        bot_owner_id = ORIGINAL_BOT_CREATOR_ID
-    else:
-        bot_owner_name = owner_data.get('first_name', 'Owner') if owner_data else 'Owner'
-        bot_owner_id = OWNER_ID
-    
-    keyboard = []
-    
-    pricing_details = get_pricing_details()
-    if pricing_details:
-        keyboard.append([InlineKeyboardButton("🤖 Get Bot Clone", callback_data="show_pricing")])
-    else:
-        keyboard.append([InlineKeyboardButton("🤖 Get Bot Clone", callback_data="get_clone")])
-    
-    backup_link = get_backup_button()
-    if backup_link:
-        keyboard.append([InlineKeyboardButton("📥 Backup Channel", url=backup_link)])
-    
-    keyboard.append([InlineKeyboardButton("ℹ️ Help", callback_data="help")])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    await save_user_data(user.id, user.username, user.first_name)
+    bot_owner_id = owner_id()
+    if user.id == bot_owner_id:
+        update_owner_name(bot_owner_id, user.first_name)
     
-    welcome_text = f"👋 Welcome {user.first_name}!\n\nThis bot is created by [{bot_owner_name}](tg://user?id={bot_owner_id})\n\nChoose an option below:"
+    bot_owner_name = await get_owner_name(bot_owner_id)
+    pricing_details = await get_pricing_details()
+    backup_link = await get_backup_button()
+    reply_markup = start_markup(bool(pricing_details), backup_link)
     
     await update.message.reply_text(
-        welcome_text,
+        welcome_text(user.first_name, bot_owner_name, bot_owner_id),
         reply_markup=reply_markup,
         parse_mode='Markdown'
     )
 
 async def help_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    help_text = "ℹ️ **Bot Help**\n\nAvailable Commands:\n/start - Start the bot\n/help - Show this help message\n/admin - Admin panel (Owner only)\n\nFor any questions, contact the bot owner."
-    
-    await update.message.reply_text(help_text, parse_mode='Markdown')
+    await update.message.reply_text(HELP_TEXT, parse_mode='Markdown')
 
 async def admin_panel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
-    if user.id != OWNER_ID:
+    if user.id != owner_id():
         await update.message.reply_text("❌ You don't have permission to access admin panel.")
         return
     
-    keyboard = [
-        [InlineKeyboardButton("👥 User Stats", callback_data="admin_stats")],
-        [InlineKeyboardButton("🔑 Generate Auth Key", callback_data="admin_generate_key")],
-        [InlineKeyboardButton("📋 View Auth Keys", callback_data="admin_view_keys")],
-        [InlineKeyboardButton("👥 View Cloners", callback_data="admin_view_cloners")],
-        [InlineKeyboardButton("🚫 Ban User", callback_data="admin_ban_user")],
-        [InlineKeyboardButton("✅ Unban User", callback_data="admin_unban_user")],
-        [InlineKeyboardButton("📥 Set Backup Button", callback_data="admin_set_backup")],
-        [InlineKeyboardButton("🗑️ Remove Backup Button", callback_data="admin_remove_backup")],
-        [InlineKeyboardButton("💰 Set Pricing Details", callback_data="admin_set_pricing")],
-        [InlineKeyboardButton("🗑️ Remove Pricing Details", callback_data="admin_remove_pricing")],
-        [InlineKeyboardButton("📢 Broadcast", callback_data="admin_broadcast")],
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("🔐 **Admin Panel**\n\nSelect an option:", reply_markup=reply_markup, parse_mode='Markdown')
-
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    
-    user_id = query.from_user.id
-    data = query.data
-    
-    if data == "help":
-        help_text = "ℹ️ **Bot Help**\n\nAvailable Commands:\n/start - Start the bot\n/help - Show this help message\n/admin - Admin panel (Owner only)\n\nFor any questions, contact the bot owner."
-        await query.edit_message_text(help_text, parse_mode='Markdown')
-    
-    elif data == "show_pricing":
-        pricing = get_pricing_details()
-        keyboard = [[InlineKeyboardButton("💳 Contact Admin to Purchase", callback_data="get_clone")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        message = f"💰 **Pricing Details**\n\n{pricing}\n\nClick below to contact admin:"
-        await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
-    
-    elif data == "get_clone":
-        owner_data = get_user_data(OWNER_ID)
-        if OWNER_ID == ORIGINAL_BOT_CREATOR_ID:
-            contact_text = f"🤖 **Want to clone this bot?**\n\nContact me to get your own bot clone!\n\n👤 Original Creator: [{ORIGINAL_BOT_CREATOR_NAME}](tg://user?id={ORIGINAL_BOT_CREATOR_ID})\n\nClick the button below to contact:"
-            keyboard = [[InlineKeyboardButton(f"💬 Contact {ORIGINAL_BOT_CREATOR_NAME}", url=f"tg://user?id={ORIGINAL_BOT_CREATOR_ID}")]]
-        else:
-            bot_owner_name = owner_data.get('first_name', 'Owner') if owner_data else 'Owner'
-            contact_text = f"🤖 **Want to clone this bot?**\n\nContact the bot owner to get your own clone!\n\n👤 Bot Owner: [{bot_owner_name}](tg://user?id={OWNER_ID})\n\n💡 Want a bot like the original? Contact [{ORIGINAL_BOT_CREATOR_NAME}](tg://user?id={ORIGINAL_BOT_CREATOR_ID})\n\nClick the buttons below:"
-            keyboard = [
-                [InlineKeyboardButton(f"💬 Contact {bot_owner_name}", url=f"tg://user?id={OWNER_ID}")],
-                [InlineKeyboardButton(f"🌟 Get Original Bot by {ORIGINAL_BOT_CREATOR_NAME}", url=f"tg://user?id={ORIGINAL_BOT_CREATOR_ID}")]
-            ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(contact_text, reply_markup=reply_markup, parse_mode='Markdown')
-    
-    elif data.startswith("admin_"):
-        if user_id != OWNER_ID:
-            await query.edit_message_text("❌ You don't have permission to use admin commands.")
-            return
-        
-        if data == "admin_stats":
-            users = get_all_users()
-            total_users = len(users)
-            banned_count = len([u for u in users if u.get('is_banned', False)])
-            stats_text = f"📊 **Bot Statistics**\n\n👥 Total Users: {total_users}\n🚫 Banned Users: {banned_count}\n✅ Active Users: {total_users - banned_count}"
-            keyboard = [[InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="back_to_admin")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(stats_text, reply_markup=reply_markup, parse_mode='Markdown')
-        
-        elif data == "admin_generate_key":
-            user_states[user_id] = "awaiting_purchaser_id"
-            await query.edit_message_text("Please send the Telegram User ID of the purchaser:")
-        
-        elif data == "admin_view_keys":
-            keys = get_all_auth_keys()
-            if not keys:
-                text = "📋 No auth keys generated yet."
-            else:
-                text = "📋 **All Auth Keys:**\n\n"
-                for key in keys:
-                    status = "✅ Used" if key.get('is_used') else "⏳ Unused"
-                    text += f"🔑 `{key['auth_key']}`\n"
-                    text += f"👤 Purchaser: {key['purchaser_name']} (ID: {key['purchaser_id']})\n"
-                    text += f"📅 Created: {key['created_at'].strftime('%Y-%m-%d %H:%M')}\n"
-                    text += f"Status: {status}\n\n"
-            keyboard = [[InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="back_to_admin")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
-        
-        elif data == "admin_view_cloners":
-            cloners = get_cloners_list()
-            if not cloners:
-                text = "👥 No one has cloned the bot yet."
-            else:
-                text = "👥 **People who cloned the bot:**\n\n"
-                for cloner in cloners:
-                    text += f"👤 {cloner['purchaser_name']} (ID: {cloner['purchaser_id']})\n"
-                    text += f"📅 Cloned: {cloner['used_at'].strftime('%Y-%m-%d %H:%M')}\n"
-                    text += f"🔑 Key: `{cloner['auth_key']}`\n\n"
-            keyboard = [[InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="back_to_admin")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
-        
-        elif data == "admin_ban_user":
-            user_states[user_id] = "awaiting_ban_user_id"
-            await query.edit_message_text("Please send the Telegram User ID to ban:")
-        
-        elif data == "admin_unban_user":
-            banned_users = get_banned_users()
-            if not banned_users:
-                text = "✅ No banned users."
-                keyboard = [[InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="back_to_admin")]]
-            else:
-                text = "🚫 **Banned Users:**\n\nSelect a user to unban:\n\n"
-                keyboard = []
-                for user in banned_users:
-                    user_name = user.get('first_name', 'Unknown')
-                    user_btn = InlineKeyboardButton(f"✅ Unban {user_name} ({user['user_id']})", callback_data=f"unban_{user['user_id']}")
-                    keyboard.append([user_btn])
-                keyboard.append([InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="back_to_admin")])
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
-        
-        elif data == "admin_set_backup":
-            user_states[user_id] = "awaiting_backup_link"
-            await query.edit_message_text("Please send the backup channel/group link:")
-        
-        elif data == "admin_remove_backup":
-            remove_backup_button()
-            await query.edit_message_text("✅ Backup button removed successfully!")
-        
-        elif data == "admin_set_pricing":
-            user_states[user_id] = "awaiting_pricing_details"
-            await query.edit_message_text("Please send the pricing details text:")
-        
-        elif data == "admin_remove_pricing":
-            remove_pricing_details()
-            await query.edit_message_text("✅ Pricing details removed successfully!")
-        
-        elif data == "admin_broadcast":
-            user_states[user_id] = "awaiting_broadcast_message"
-            await query.edit_message_text("Please send the broadcast message:")
-        
-        elif data == "back_to_admin":
-            keyboard = [
-                [InlineKeyboardButton("👥 User Stats", callback_data="admin_stats")],
-                [InlineKeyboardButton("🔑 Generate Auth Key", callback_data="admin_generate_key")],
-                [InlineKeyboardButton("📋 View Auth Keys", callback_data="admin_view_keys")],
-                [InlineKeyboardButton("👥 View Cloners", callback_data="admin_view_cloners")],
-                [InlineKeyboardButton("🚫 Ban User", callback_data="admin_ban_user")],
-                [InlineKeyboardButton("✅ Unban User", callback_data="admin_unban_user")],
-                [InlineKeyboardButton("📥 Set Backup Button", callback_data="admin_set_backup")],
-                [InlineKeyboardButton("🗑️ Remove Backup Button", callback_data="admin_remove_backup")],
-                [InlineKeyboardButton("💰 Set Pricing Details", callback_data="admin_set_pricing")],
-                [InlineKeyboardButton("🗑️ Remove Pricing Details", callback_data="admin_remove_pricing")],
-                [InlineKeyboardButton("📢 Broadcast", callback_data="admin_broadcast")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text("🔐 **Admin Panel**\n\nSelect an option:", reply_markup=reply_markup, parse_mode='Markdown')
-    
-    elif data.startswith("unban_"):
-        if user_id != OWNER_ID:
-            return
-        target_user_id = int(data.split("_")[1])
-        unban_user(target_user_id)
-        await query.edit_message_text(f"✅ User {target_user_id} has been unbanned!")
-    
-    elif data.startswith("revoke_"):
-        if user_id != OWNER_ID:
-            return
-        auth_key = data.split("revoke_")[1]
-        new_key = revoke_auth_key(auth_key)
-        if new_key:
-            await query.edit_message_text(f"✅ Auth key revoked successfully!\n\n🔑 New Key: `{new_key}`\n\nThe old key is now invalid and a fresh key has been generated.", parse_mode='Markdown')
-        else:
-            await query.edit_message_text("❌ Failed to revoke auth key.")
+    await update.message.reply_text(ADMIN_PANEL_TEXT, reply_markup=ADMIN_PANEL_MARKUP, parse_mode='Markdown')
 
-async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    message_text = update.message.text
-    if user_id not in user_states:
+async def clone_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = update.message
+    clone_host = context.application.bot_data.get('clone_host')
+    if clone_host is None:
+        await message.reply_text("❌ Clone hosting is not enabled on this bot.")
+        return
+    args = context.args or []
+    if len(args) != 2 or not CLONE_TOKEN_PATTERN.match(args[1]):
+        await message.reply_text("Usage: /clone <auth key> <bot token from @BotFather>")
         return
-    state = user_states[user_id]
-    if user_id != OWNER_ID:
+    auth_key, bot_token = args
+    tenant_name = await redeem_clone(auth_key, update.effective_user.id, bot_token)
+    if tenant_name is None:
+        await message.reply_text("❌ Invalid, revoked or already used auth key.")
         return
-    if state == "awaiting_purchaser_id":
+    clone_host.request_sync()
+    await message.reply_text("✅ Auth key redeemed! Your clone is starting and will answer in a few seconds. You are its owner, use /admin there.")
+
+BULK_USAGE = {
+    "ban": "Usage: /ban followed by user IDs separated by spaces, commas or new lines.",
+    "unban": "Usage: /unban followed by user IDs separated by spaces, commas or new lines.",
+    "genkeys": "Usage: /genkeys followed by one `purchaser_id,purchaser_name` line per key.",
+}
+
+def parse_user_ids(text):
+    user_ids = []
+    invalid = 0
+    for token in re.split(r"[\s,;]+", text):
+        if not token:
+            continue
         try:
-            purchaser_id = int(message_text)
-            user_states[user_id] = f"awaiting_purchaser_name_{purchaser_id}"
-            await update.message.reply_text("Now send the purchaser's name:")
+            user_ids.append(int(token))
         except ValueError:
-            await update.message.reply_text("❌ Invalid User ID. Please send a valid number.")
-    elif state.startswith("awaiting_purchaser_name_"):
-        purchaser_id = int(state.split("_")[-1])
-        purchaser_name = message_text
-        auth_key = generate_auth_key(purchaser_id, purchaser_name)
-        keyboard = [
-            [InlineKeyboardButton("🗑️ Revoke This Key", callback_data=f"revoke_{auth_key}")],
-            [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="back_to_admin")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(f"✅ Auth key generated successfully!\n\n🔑 Key: `{auth_key}`\n👤 For: {purchaser_name} (ID: {purchaser_id})\n\nSend this key to the purchaser.", reply_markup=reply_markup, parse_mode='Markdown')
-        del user_states[user_id]
-    elif state == "awaiting_ban_user_id":
+            invalid += 1
+    return user_ids, invalid
+
+def parse_purchasers(text):
+    purchasers = []
+    invalid = 0
+    for row in csv.reader(io.StringIO(text)):
+        if not row or not row[0].strip():
+            continue
         try:
-            ban_target_id = int(message_text)
-            if ban_target_id == OWNER_ID:
-                await update.message.reply_text("❌ You cannot ban yourself!")
-            else:
-                ban_user(ban_target_id)
-                await update.message.reply_text(f"✅ User {ban_target_id} has been banned!")
-            del user_states[user_id]
+            purchaser_id = int(row[0])
         except ValueError:
-            await update.message.reply_text("❌ Invalid User ID. Please send a valid number.")
-    elif state == "awaiting_backup_link":
-        set_backup_button(message_text)
-        await update.message.reply_text("✅ Backup button added successfully! It will now appear for all users.")
-        del user_states[user_id]
-    elif state == "awaiting_pricing_details":
-        set_pricing_details(message_text)
-        await update.message.reply_text("✅ Pricing details saved successfully! Users will see this before contacting you.")
-        del user_states[user_id]
-    elif state == "awaiting_broadcast_message":
-        users = get_all_users()
-        success_count = 0
-        fail_count = 0
-        for user in users:
-            if not user.get('is_banned', False):
-                try:
-                    await context.bot.send_message(chat_id=user['user_id'], text=f"📢 **Broadcast Message**\n\n{message_text}", parse_mode='Markdown')
-                    success_count += 1
-                except Exception as e:
-                    fail_count += 1
-        await update.message.reply_text(f"✅ Broadcast completed!\n\n📤 Sent: {success_count}\n❌ Failed: {fail_count}")
-        del user_states[user_id]
-"""
+            invalid += 1
+            continue
+        purchaser_name = ",".join(row[1:]).strip()
+        if not purchaser_name:
+            invalid += 1
+            continue
+        purchasers.append((purchaser_id, purchaser_name))
+    return purchasers, invalid
 
-# 4. requirements.txt content
-requirements_txt = """python-telegram-bot==20.7
-pymongo==4.6.1
-python-dotenv==1.0.0"""
+async def read_bulk_input(message):
+    if message.document:
+        if message.document.file_size and message.document.file_size > BULK_MAX_FILE_SIZE:
+            return None
+        telegram_file = await message.document.get_file()
+        return (await telegram_file.download_as_bytearray()).decode("utf-8-sig", errors="replace")
+    parts = message.text.split(None, 1)
+    return parts[1] if len(parts) > 1 else ""
 
-# 5. .env.example content
-env_example = """BOT_TOKEN=your_bot_token_here
-MONGO_URI=your_mongodb_uri_here
-OWNER_ID=your_telegram_user_id_here"""
+async def bulk_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = update.message
+    if update.effective_user.id != owner_id():
+        await message.reply_text("❌ You don't have permission to use bulk admin commands.")
+        return
+    command = (message.text or message.caption).split(None, 1)[0][1:].split("@")[0].lower()
+    text = await read_bulk_input(message)
+    if text is None:
+        await message.reply_text(f"❌ File is too large (limit {BULK_MAX_FILE_SIZE // 1024} KB).")
+        return
 
-# 6. Dockerfile content
-dockerfile = """FROM python:3.11-slim
-WORKDIR /app
-COPY requirements.txt .
-RUN pip install --no-cache-dir -r requirements.txt
-COPY . .
-CMD ["python", "main.py"]"""
+    if command == "genkeys":
+        purchasers, invalid = parse_purchasers(text)
+        if not purchasers:
+            await message.reply_text(BULK_USAGE[command], parse_mode='Markdown')
+            return
+        auth_keys = await generate_auth_keys(purchasers)
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(["purchaser_id", "purchaser_name", "auth_key"])
+        writer.writerows((purchaser_id, purchaser_name, auth_key) for (purchaser_id, purchaser_name), auth_key in zip(purchasers, auth_keys))
+        await message.reply_document(
+            document=output.getvalue().encode(),
+            filename="auth_keys.csv",
+            caption=f"✅ Generated {len(auth_keys)} auth keys." + (f" Skipped {invalid} invalid lines." if invalid else "")
+        )
+        return
+
+    user_ids, invalid = parse_user_ids(text)
+    bot_owner_id = owner_id()
+    if command == "ban" and bot_owner_id in user_ids:
+        user_ids = [target_id for target_id in user_ids if target_id != bot_owner_id]
+        invalid += 1
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        await message.reply_text(BULK_USAGE[command])
+        return
+    if command == "ban":
+        changed = await ban_users(user_ids)
+        summary = f"✅ Ban applied to {len(user_ids)} user IDs, {changed} registered users newly banned."
+    else:
+        changed = await unban_users(user_ids)
+        summary = f"✅ Unban applied to {len(user_ids)} user IDs, {changed} registered users unbanned."
+    if invalid:
+        summary += f" Skipped {invalid} invalid entries."
+    await message.reply_text(summary)
+
+SNAPSHOT_USAGE = {
+    "export": "Usage: /export, optionally followed by the collections to include: " + ", ".join(SNAPSHOT_COLLECTIONS),
+    "import": "Usage: send a snapshot file made by /export with /import as its caption.",
+}
+
+async def send_snapshot(bot, chat_id, collection_names=None):
+    # The export streams into a temporary file; only the finished, compressed
+    # snapshot is read into memory for the upload.
+    await flush_user_data()
+    with tempfile.TemporaryFile() as snapshot:
+        counts = await export_snapshot(snapshot, collection_names)
+        snapshot.seek(0)
+        await bot.send_document(
+            chat_id,
+            document=snapshot,
+            filename=f"snapshot-{current_tenant().name}-{time.strftime('%Y%m%d-%H%M%S')}.ndjson.gz",
+            caption="✅ Exported " + ", ".join(f"{count} {name}" for name, count in counts.items()) + "."
+        )
+
+async def snapshot_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = update.message
+    if update.effective_user.id != owner_id():
+        await message.reply_text("❌ You don't have permission to use admin commands.")
+        return
+    command = (message.text or message.caption).split(None, 1)[0][1:].split("@")[0].lower()
+    if command == "export":
+        collection_names = [name.lower() for name in message.text.split()[1:]]
+        if any(name not in SNAPSHOT_COLLECTIONS for name in collection_names):
+            await message.reply_text(SNAPSHOT_USAGE[command])
+            return
+        await send_snapshot(context.bot, message.chat_id, collection_names)
+        return
+
+    if not message.document:
+        await message.reply_text(SNAPSHOT_USAGE[command])
+        return
+    if message.document.file_size and message.document.file_size > SNAPSHOT_MAX_FILE_SIZE:
+        await message.reply_text(f"❌ File is too large (limit {SNAPSHOT_MAX_FILE_SIZE // (1024 * 1024)} MB).")
+        return
+    telegram_file = await message.document.get_file()
+    with tempfile.TemporaryFile() as snapshot:
+        await telegram_file.download_to_memory(snapshot)
+        snapshot.seek(0)
+        try:
+            counts, invalid, complete = await import_snapshot(snapshot)
+        except (PyMongoError, BSONError) as e:
+            await message.reply_text(f"❌ Import stopped by a database error: {e}\nRows written before it were kept; fix the file and run /import again.")
+            return
+    if not complete and not any(count["inserted"] or count["skipped"] for count in counts.values()):
+        await message.reply_text("❌ That file is not a snapshot made by /export.")
+        return
+    summary = "\n".join(f"{name}: {count['inserted']} added, {count['skipped']} already present" for name, count in counts.items())
+    if invalid:
+        summary += f"\nSkipped {invalid} unreadable lines."
+    if complete:
+        await message.reply_text("✅ Import finished.\n\n" + summary)
+    else:
+        await message.reply_text("⚠️ The file is damaged or cut short. Rows before that point were imported:\n\n" + summary)
+
+LISTINGS = {
+    "keys": (get_auth_keys_page, auth_keys_page_view),
+    "cloners": (get_cloners_page, cloners_page_view),
+    "banned": (get_banned_users_page, banned_users_page_view),
+}
+
+async def show_listing_page(query, listing, after=None, before=None):
+    fetch_page, render_page = LISTINGS[listing]
+    page = await fetch_page(after=after, before=before)
+    text, reply_markup = render_page(page)
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+# Exact callback data -> (callback, owner_only), and the same for prefixed
+# payloads; each callback gets the query and whatever follows the prefix.
+CALLBACK_ROUTES = {}
+# Keyed by the text up to and including the first "_" or ":", so a prefixed
+# payload is resolved with one dict lookup however many prefixes there are.
+CALLBACK_PREFIXES = {}
+
+def callback(data, owner_only=False):
+    def register(func):
+        CALLBACK_ROUTES[data] = (func, owner_only)
+        return func
+    return register
+
+def callback_prefix(prefix, owner_only=False):
+    if prefix[-1:] not in ("_", ":") or "_" in prefix[:-1] or ":" in prefix[:-1]:
+        raise ValueError(f"Callback prefix {prefix!r} must end at its first '_' or ':'")
+
+    def register(func):
+        CALLBACK_PREFIXES[prefix] = (func, owner_only)
+        return func
+    return register
+
+def resolve_callback(data):
+    route = CALLBACK_ROUTES.get(data)
+    if route is not None:
+        return data, route, ""
+    head, separator, payload = data.partition(":")
+    if "_" in head:
+        head, separator, payload = data.partition("_")
+    prefix = head + separator
+    route = CALLBACK_PREFIXES.get(prefix)
+    if route is not None:
+        return prefix, route, payload
+    return "other", None, None
+
+def callback_route(update):
+    return resolve_callback(update.callback_query.data or "")[0]
+
+@callback("help")
+async def help_callback(query, payload):
+    await query.edit_message_text(HELP_TEXT, parse_mode='Markdown')
+
+@callback("show_pricing")
+async def show_pricing_callback(query, payload):
+    pricing = await get_pricing_details()
+    message, reply_markup = pricing_view(pricing)
+    await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+
+@callback("get_clone")
+async def get_clone_callback(query, payload):
+    bot_owner_id = owner_id()
+    bot_owner_name = await get_owner_name(bot_owner_id)
+    contact_text, reply_markup = clone_contact_view(bot_owner_id, bot_owner_name)
+    await query.edit_message_text(contact_text, reply_markup=reply_markup, parse_mode='Markdown')
+
+@callback("admin_stats", owner_only=True)
+async def admin_stats_callback(query, payload):
+    await flush_user_data()
+    stats = await get_user_stats()
+    total_users = stats['total_users']
+    banned_count = stats['banned_users']
+    stats_text = f"📊 **Bot Statistics**\n\n👥 Total Users: {total_users}\n🚫 Banned Users: {banned_count}\n✅ Active Users: {total_users - banned_count}"
+    stats_text += f"\n\n🟢 Seen in last 24h: {stats['active_24h']}\n📆 Seen in last 7 days: {stats['active_7d']}"
+    if stats['new_users_per_day']:
+        stats_text += "\n\n🆕 **New Users per Day:**\n"
+        stats_text += "\n".join(f"{day}: {count}" for day, count in stats['new_users_per_day'])
+    await query.edit_message_text(stats_text, reply_markup=BACK_TO_ADMIN_MARKUP, parse_mode='Markdown')
+
+def _prompt(step, prompt):
+    async def ask(query, payload):
+        await conversation_states.set(query.from_user.id, {"step": step})
+        await query.edit_message_text(prompt)
+    return ask
+
+callback("admin_generate_key", owner_only=True)(_prompt("awaiting_purchaser_id", "Please send the Telegram User ID of the purchaser:"))
+callback("admin_ban_user", owner_only=True)(_prompt("awaiting_ban_user_id", "Please send the Telegram User ID to ban:"))
+callback("admin_set_backup", owner_only=True)(_prompt("awaiting_backup_link", "Please send the backup channel/group link:"))
+callback("admin_set_pricing", owner_only=True)(_prompt("awaiting_pricing_details", "Please send the pricing details text:"))
+callback("admin_broadcast", owner_only=True)(_prompt("awaiting_broadcast_message", "Please send the broadcast message:"))
+
+def _listing(listing):
+    async def show(query, payload):
+        await show_listing_page(query, listing)
+    return show
+
+callback("admin_view_keys", owner_only=True)(_listing("keys"))
+callback("admin_view_cloners", owner_only=True)(_listing("cloners"))
+callback("admin_unban_user", owner_only=True)(_listing("banned"))
+
+@callback("admin_broadcast_jobs", owner_only=True)
+async def broadcast_jobs_callback(query, payload):
+    text, reply_markup = broadcast_jobs_view(await get_active_broadcast_jobs())
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+BROADCAST_ACTIONS = {
+    "pause": ("paused", ("queued", "running")),
+    "resume": ("queued", ("paused",)),
+    "cancel": ("cancelled", ("queued", "running", "paused")),
+}
+
+@callback_prefix("bcast:", owner_only=True)
+async def broadcast_control_callback(query, payload):
+    action, _, job_id = payload.partition(":")
+    if action not in BROADCAST_ACTIONS:
+        return
+    status, from_statuses = BROADCAST_ACTIONS[action]
+    job = await set_broadcast_status(job_id, status, from_statuses)
+    if job is None:
+        text, reply_markup = broadcast_jobs_view(await get_active_broadcast_jobs())
+        await query.edit_message_text(text, reply_markup=reply_markup)
+        return
+    # A running sender notices within one checkpoint and posts its final counts.
+    text, reply_markup = broadcast_job_view(job)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+@callback("admin_export", owner_only=True)
+async def export_callback(query, payload):
+    await query.edit_message_text("⏳ Preparing the export...")
+    await send_snapshot(query.get_bot(), query.from_user.id)
+
+@callback("admin_remove_backup", owner_only=True)
+async def remove_backup_callback(query, payload):
+    await remove_backup_button()
+    await query.edit_message_text("✅ Backup button removed successfully!")
+
+@callback("admin_remove_pricing", owner_only=True)
+async def remove_pricing_callback(query, payload):
+    await remove_pricing_details()
+    await query.edit_message_text("✅ Pricing details removed successfully!")
+
+@callback("back_to_admin", owner_only=True)
+async def back_to_admin_callback(query, payload):
+    await query.edit_message_text(ADMIN_PANEL_TEXT, reply_markup=ADMIN_PANEL_MARKUP, parse_mode='Markdown')
+
+@callback_prefix("page:", owner_only=True)
+async def page_callback(query, payload):
+    listing, direction, cursor = payload.split(":")
+    if listing not in LISTINGS:
+        return
+    if direction == "next":
+        await show_listing_page(query, listing, after=cursor)
+    else:
+        await show_listing_page(query, listing, before=cursor)
+
+@callback_prefix("unban_", owner_only=True)
+async def unban_callback(query, payload):
+    target_user_id = int(payload)
+    await unban_user(target_user_id)
+    await query.edit_message_text(f"✅ User {target_user_id} has been unbanned!")
+
+@callback_prefix("revoke_", owner_only=True)
+async def revoke_callback(query, payload):
+    new_key = await revoke_auth_key(payload)
+    if new_key:
+        await query.edit_message_text(f"✅ Auth key revoked successfully!\n\n🔑 New Key: `{new_key}`\n\nThe old key is now invalid and a fresh key has been generated.", parse_mode='Markdown')
+    else:
+        await query.edit_message_text("❌ Failed to revoke auth key.")
+
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    _, route, payload = resolve_callback(query.data or "")
+    if route is None:
+        return
+    func, owner_only = route
+    if owner_only and query.from_user.id != owner_id():
+        await query.edit_message_text("❌ You don't have permission to use admin commands.")
+        return
+    await func(query, payload)
+
+async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    message_text = update.message.text
+    if user_id != owner_id():
+        return
+    state = await conversation_states.get(user_id)
+    if state is None:
+        return
+    step = state['step']
+    if step == "awaiting_purchaser_id":
+        try:
+            purchaser_id = int(message_text)
+            await conversation_states.set(user_id, {"step": "awaiting_purchaser_name", "purchaser_id": purchaser_id})
+            await update.message.reply_text("Now send the purchaser's name:")
+        except ValueError:
+            await update.message.reply_text("❌ Invalid User ID. Please send a valid number.")
+    elif step == "awaiting_purchaser_name":
+        purchaser_id = state['purchaser_id']
+        purchaser_name = message_text
+        auth_key = await generate_auth_key(purchaser_id, purchaser_name)
+        keyboard = [
+            [InlineKeyboardButton("🗑️ Revoke This Key", callback_data=f"revoke_{auth_key}")],
+            [BACK_TO_ADMIN_BUTTON]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text(f"✅ Auth key generated successfully!\n\n🔑 Key: `{auth_key}`\n👤 For: {purchaser_name} (ID: {purchaser_id})\n\nSend this key to the purchaser.", reply_markup=reply_markup, parse_mode='Markdown')
+        await conversation_states.delete(user_id)
+    elif step == "awaiting_ban_user_id":
+        try:
+            ban_target_id = int(message_text)
+            if ban_target_id == owner_id():
+                await update.message.reply_text("❌ You cannot ban yourself!")
+            else:
+                await ban_user(ban_target_id)
+                await update.message.reply_text(f"✅ User {ban_target_id} has been banned!")
+            await conversation_states.delete(user_id)
+        except ValueError:
+            await update.message.reply_text("❌ Invalid User ID. Please send a valid number.")
+    elif step == "awaiting_backup_link":
+        await set_backup_button(message_text)
+        await update.message.reply_text("✅ Backup button added successfully! It will now appear for all users.")
+        await conversation_states.delete(user_id)
+    elif step == "awaiting_pricing_details":
+        await set_pricing_details(message_text)
+        await update.message.reply_text("✅ Pricing details saved successfully! Users will see this before contacting you.")
+        await conversation_states.delete(user_id)
+    elif step == "awaiting_broadcast_message":
+        status_message = await update.message.reply_text("📢 Broadcast queued! Progress will be updated here.")
+        await flush_user_data()
+        await create_broadcast_job(
+            f"📢 **Broadcast Message**\n\n{message_text}",
+            progress_chat_id=status_message.chat_id,
+            progress_message_id=status_message.message_id
+        )
+        wakeup = context.application.bot_data.get('broadcast_wakeup')
+        if wakeup is not None:
+            wakeup.set()
+        await conversation_states.delete(user_id)
+"""
+
+# 4. requirements.txt content
+requirements_txt = """python-telegram-bot==20.7
+pymongo==4.6.1
+python-dotenv==1.0.0
+aiohttp==3.9.5"""
+
+# 5. .env.example content
+env_example = """BOT_TOKEN=your_bot_token_here
+MONGO_URI=your_mongodb_uri_here
+OWNER_ID=your_telegram_user_id_here"""
+
+# 6. Dockerfile content
+dockerfile = """FROM python:3.11-slim
+WORKDIR /app
+COPY requirements.txt .
+RUN pip install --no-cache-dir -r requirements.txt
+COPY . .
+CMD ["python", "main.py"]"""
 
 # 7. README.md content
 readme_md = """# Telegram Bot Clone System
@@ -545,19 +1526,1980 @@ A powerful Telegram bot with cloning capabilities and admin features.
    - OWNER_ID
 6. Deploy!
 
+## Webhook Mode
+Polling is the default. To receive updates by webhook instead, set:
+- BOT_MODE=webhook
+- WEBHOOK_URL - public https base URL, e.g. https://bot.example.com (TLS can be terminated by your platform)
+- WEBHOOK_SECRET - secret token Telegram sends with every update; requests without it are rejected (a random one is generated on each start when unset)
+- WEBHOOK_PATH (default /telegram), WEBHOOK_LISTEN (default 0.0.0.0), WEBHOOK_PORT (default $PORT or 8080)
+- WEBHOOK_CERT / WEBHOOK_KEY - only when serving TLS directly
+
+A health check is served at /healthz.
+
+## Clone Hosting
+Set `CLONE_HOST=1` to run purchased clones inside this process instead of one container each. Buyers send `/clone <auth key> <bot token>` to the main bot. Redeeming the key registers the clone and starts it within seconds. Revoking the key stops it. Every clone polls with its own token and has its own owner (the buyer) and database (`clone_<bot id>`), all on one shared MongoDB connection pool. Clone hosting uses long polling for the clones.
+
+## Optional Settings
+- TENANT_SYNC_INTERVAL - seconds between checks for redeemed or revoked clones (default 10)
+- MONGO_DB_NAME - database used by the main bot (default telegram_bot)
+- TENANT_DB_PREFIX - database name prefix for hosted clones (default clone_)
+- BOT_API_URL - Bot API base URL for a self-hosted Bot API server, e.g. http://localhost:8081/bot
+- DROP_PENDING_UPDATES - set to 1 to discard updates queued while the bot was down
+- BULK_MAX_FILE_SIZE - largest CSV accepted by /ban, /unban and /genkeys, in bytes (default 1048576)
+- SNAPSHOT_MAX_FILE_SIZE - largest snapshot accepted by /import, in bytes (default 20971520, the Bot API download limit)
+- BROADCAST_GLOBAL_RATE - messages per second across all chats (default 25)
+- BROADCAST_PER_CHAT_RATE - messages per second to a single chat (default 1)
+- BROADCAST_CONCURRENCY - parallel senders per broadcast (default 20)
+- BROADCAST_PROGRESS_INTERVAL - seconds between progress updates (default 10)
+- DB_POOL_SIZE - worker threads running MongoDB calls off the event loop (default 16)
+- MONGO_MAX_POOL_SIZE / MONGO_MIN_POOL_SIZE - MongoDB connections kept open at most / at least (default 32 / 4)
+- MONGO_MAX_IDLE_TIME_MS - idle connections above the minimum are closed after this long (default 300000)
+- MONGO_CONNECT_TIMEOUT_MS / MONGO_SOCKET_TIMEOUT_MS - connect and per-operation socket timeouts (default 5000 / 30000)
+- MONGO_SERVER_SELECTION_TIMEOUT_MS - how long an operation waits for a reachable server before failing (default 5000)
+- CONCURRENT_UPDATES - updates processed in parallel (default 256)
+- DB_BATCH_SIZE - documents fetched per round-trip when streaming users or keys (default 1000)
+- USER_FLUSH_INTERVAL - seconds between batched user profile writes (default 2)
+- USER_FLUSH_SIZE - buffered users that trigger an early write (default 500)
+- BROADCAST_CHECKPOINT_INTERVAL - seconds between saved broadcast progress checkpoints (default 2)
+- BROADCAST_POLL_INTERVAL - seconds between checks for queued or orphaned broadcast jobs (default 5)
+- BROADCAST_LOG_TTL - seconds failed and blocked broadcast deliveries stay in broadcast_log (default 604800)
+- BROADCAST_LEASE_SECONDS - how long a crashed sender holds a broadcast before another start resumes it (default 60)
+- FLOOD_RATE - updates per second a user may send once their burst is spent, 0 to disable (default 1)
+- FLOOD_BURST - updates a user may send back to back (default 5)
+- FLOOD_MAX_USERS - users tracked by flood control before the least recent are forgotten (default 10000)
+- CALLBACK_DEDUPE_WINDOW - seconds in which repeated taps on the same button count once (default 1)
+- STATE_BACKEND - where admin conversation steps are kept: memory or mongo (default memory)
+- STATE_TTL - seconds before an abandoned admin conversation expires (default 900)
+- ADMIN_PAGE_SIZE - entries per page in the admin key, cloner and banned user lists (default 10)
+- METRICS_PORT - port for the Prometheus /metrics endpoint, 0 to disable (default 9090)
+- METRICS_LISTEN - address the metrics endpoint binds to (default 127.0.0.1)
+- SETTINGS_CACHE_TTL - seconds the pricing/backup settings are served from memory, 0 to never expire (default 60)
+- BAN_CACHE_TTL - seconds between reloads of the in-memory ban list, so bans made by other replicas take effect, 0 for a single process (default 30)
+- SETTINGS_WATCH - set to 1 to refresh settings from a MongoDB change stream (replica sets only)
+
+## Benchmarks
+Run offline benchmarks against a fake bot. They use mongomock unless given `--uri`, so install the dev requirements first:
+```
+pip install -r requirements-dev.txt
+python benchmarks.py broadcast --users 300 --latency 0.1
+python benchmarks.py indexes --uri mongodb://localhost:27017
+python benchmarks.py webhook --updates 2000 --concurrency 50
+python benchmarks.py handlers --updates 2000
+python benchmarks.py dispatch
+python benchmarks.py flood --updates 2000
+python benchmarks.py snapshot --users 20000
+python benchmarks.py load --rate 100 --duration 10
+python benchmarks.py redeem --uri mongodb://localhost:27017 --redeemers 16
+python benchmarks.py tenants --tenants 50
+```
+`redeem` needs `--uri` pointing at a real mongod, because mongomock cannot show whether redemption is atomic. It exits non-zero if the atomic path lets any key be redeemed twice, or if a key is reissued more than once when revoked. The verify+mark row shows the old two-step race for comparison and does not fail the run. The revoke row says whether it ran inside a transaction: only a replica set or sharded cluster has them, so point `--uri` at one to cover that path, while a standalone mongod covers the fallback without one. Revoking must also deactivate every clone registered with the old key.
+
+`load` starts the bot through `main.main()` against a local fake Bot API and mongomock (or the `bench_load` database on `--uri`, dropped before and after the run), replays a mix of /start, button taps and admin flows, and reports p50/p99 latency and updates/sec.
+
 ## Creator
 Original bot created by Sam (Telegram ID: 7504969018)
 """
 
+# 8. broadcast.py content
+broadcast_py = r"""import os
+import asyncio
+import logging
+import time
+from telegram.error import RetryAfter, Forbidden, TelegramError
+from metrics import BROADCAST_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_GLOBAL_RATE = float(os.environ.get('BROADCAST_GLOBAL_RATE', '25'))
+BROADCAST_PER_CHAT_RATE = float(os.environ.get('BROADCAST_PER_CHAT_RATE', '1'))
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', '20'))
+BROADCAST_PROGRESS_INTERVAL = float(os.environ.get('BROADCAST_PROGRESS_INTERVAL', '10'))
+BROADCAST_MAX_RETRIES = int(os.environ.get('BROADCAST_MAX_RETRIES', '3'))
+
+def retry_after_seconds(error):
+    delay = error.retry_after
+    if hasattr(delay, 'total_seconds'):
+        delay = delay.total_seconds()
+    return float(delay)
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        # Telegram asked us to back off: push the bucket into debt so every
+        # waiter sleeps for at least `seconds` before the next send.
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+class ChatRateLimiter:
+    def __init__(self, rate, max_tracked=10000):
+        self.interval = 1.0 / rate
+        self.max_tracked = max_tracked
+        self.next_allowed = {}
+
+    def _prune(self, now):
+        self.next_allowed = {chat_id: t for chat_id, t in self.next_allowed.items() if t > now}
+
+    async def acquire(self, chat_id):
+        now = time.monotonic()
+        if len(self.next_allowed) >= self.max_tracked:
+            self._prune(now)
+        allowed_at = self.next_allowed.get(chat_id, now)
+        self.next_allowed[chat_id] = max(allowed_at, now) + self.interval
+        if allowed_at > now:
+            await asyncio.sleep(allowed_at - now)
+
+class Broadcast:
+    def __init__(self, bot, text, recipients, parse_mode='Markdown',
+                 concurrency=BROADCAST_CONCURRENCY, global_rate=BROADCAST_GLOBAL_RATE,
+                 per_chat_rate=BROADCAST_PER_CHAT_RATE, progress_chat_id=None,
+                 progress_message_id=None, progress_interval=BROADCAST_PROGRESS_INTERVAL,
+                 progress_markup=None, on_result=None):
+        self.bot = bot
+        self.text = text
+        self.recipients = recipients
+        self.parse_mode = parse_mode
+        self.concurrency = concurrency
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_limiter = ChatRateLimiter(per_chat_rate)
+        self.progress_chat_id = progress_chat_id
+        self.progress_message_id = progress_message_id
+        self.progress_interval = progress_interval
+        self.progress_markup = progress_markup
+        self.on_result = on_result
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.retried = 0
+        self.stopped = False
+        self.processed_at_start = 0
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def processed(self):
+        return self.sent + self.failed
+
+    @property
+    def rate(self):
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return (self.processed - self.processed_at_start) / elapsed if elapsed > 0 else 0.0
+
+    def stop(self):
+        # Stop taking new recipients; whatever is already queued still goes out.
+        self.stopped = True
+
+    def _record(self, chat_id, result):
+        if self.on_result is not None:
+            self.on_result(chat_id, result)
+
+    def progress_text(self):
+        return f"📢 Broadcast in progress...\n\n📤 Sent: {self.sent}\n❌ Failed: {self.failed}\n⚡ Rate: {self.rate:.1f} msg/s"
+
+    def summary_text(self):
+        return f"✅ Broadcast completed!\n\n📤 Sent: {self.sent}\n❌ Failed: {self.failed}\n🚫 Blocked: {self.blocked}\n⏱️ Took: {self.finished_at - self.started_at:.1f}s"
+
+    async def _send(self, chat_id):
+        for attempt in range(BROADCAST_MAX_RETRIES + 1):
+            await self.global_bucket.acquire()
+            await self.chat_limiter.acquire(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=self.text, parse_mode=self.parse_mode)
+                self.sent += 1
+                BROADCAST_MESSAGES.inc(result="sent")
+                self._record(chat_id, "sent")
+                return
+            except RetryAfter as e:
+                self.retried += 1
+                BROADCAST_MESSAGES.inc(result="retry_after")
+                self.global_bucket.pause(retry_after_seconds(e))
+            except Forbidden:
+                self.blocked += 1
+                self.failed += 1
+                BROADCAST_MESSAGES.inc(result="forbidden")
+                self._record(chat_id, "blocked")
+                return
+            except TelegramError as e:
+                logger.debug("Broadcast to %s failed: %s", chat_id, e)
+                self.failed += 1
+                BROADCAST_MESSAGES.inc(result=type(e).__name__)
+                self._record(chat_id, "failed")
+                return
+        self.failed += 1
+        BROADCAST_MESSAGES.inc(result="retries_exhausted")
+        self._record(chat_id, "failed")
+
+    async def _worker(self, queue):
+        while True:
+            chat_id = await queue.get()
+            if chat_id is None:
+                return
+            await self._send(chat_id)
+
+    async def edit_progress(self, text, reply_markup=None):
+        if self.progress_chat_id is None or self.progress_message_id is None:
+            return
+        await self.chat_limiter.acquire(self.progress_chat_id)
+        try:
+            await self.bot.edit_message_text(text, chat_id=self.progress_chat_id, message_id=self.progress_message_id,
+                                             reply_markup=reply_markup)
+        except RetryAfter as e:
+            self.global_bucket.pause(retry_after_seconds(e))
+        except TelegramError as e:
+            logger.debug("Broadcast progress edit failed: %s", e)
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self.edit_progress(self.progress_text(), self.progress_markup)
+
+    async def run(self):
+        self.started_at = time.monotonic()
+        self.processed_at_start = self.processed
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        progress = asyncio.create_task(self._report_progress())
+        try:
+            if hasattr(self.recipients, '__aiter__'):
+                async for chat_id in self.recipients:
+                    if self.stopped:
+                        break
+                    await queue.put(chat_id)
+            else:
+                for chat_id in self.recipients:
+                    if self.stopped:
+                        break
+                    await queue.put(chat_id)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            progress.cancel()
+            for worker in workers:
+                worker.cancel()
+            self.finished_at = time.monotonic()
+        logger.info("Broadcast %s: %d sent, %d failed (%d blocked) at %.1f msg/s",
+                    "stopped" if self.stopped else "finished", self.sent, self.failed, self.blocked, self.rate)
+        if not self.stopped:
+            await self.edit_progress(self.summary_text())
+        return self
+"""
+
+# 9. benchmarks.py content
+benchmarks_py = r"""import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import signal
+import sys
+import time
+import timeit
+import uuid
+from datetime import datetime
+
+# Benchmarks drive the bot's own data layer against mongomock so they can never
+# write synthetic users into a real database; --uri targets a mongod explicitly.
+# MONGO_URI from the environment is deliberately ignored: in a deployed
+# container it points at production.
+os.environ['MONGO_URI'] = 'mongomock://'
+
+from pymongo import MongoClient
+from telegram.error import RetryAfter, Forbidden
+from telegram.request import BaseRequest
+from broadcast import Broadcast
+from database import ensure_indexes
+
+class FakeBot:
+    def __init__(self, latency, retry_after_rate=0.0, blocked_rate=0.0):
+        self.latency = latency
+        self.retry_after_rate = retry_after_rate
+        self.blocked_rate = blocked_rate
+        self.sent = 0
+        self.edits = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        roll = random.random()
+        if roll < self.retry_after_rate:
+            raise RetryAfter(1)
+        if roll < self.retry_after_rate + self.blocked_rate:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        self.sent += 1
+
+    async def edit_message_text(self, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.edits += 1
+
+async def serial_broadcast(bot, recipients):
+    success_count = 0
+    fail_count = 0
+    for chat_id in recipients:
+        try:
+            await bot.send_message(chat_id=chat_id, text="benchmark", parse_mode='Markdown')
+            success_count += 1
+        except Exception:
+            fail_count += 1
+    return success_count, fail_count
+
+def report(name, count, elapsed):
+    print(f"{name:<10} {count:>7} msgs in {elapsed:7.2f}s  ->  {count / elapsed:8.1f} msg/s")
+
+async def bench_broadcast(args):
+    recipients = range(1, args.users + 1)
+    random.seed(args.seed)
+    if not args.skip_serial:
+        bot = FakeBot(args.latency, args.retry_after_rate, args.blocked_rate)
+        started = time.monotonic()
+        await serial_broadcast(bot, recipients)
+        report("serial", args.users, time.monotonic() - started)
+    random.seed(args.seed)
+    bot = FakeBot(args.latency, args.retry_after_rate, args.blocked_rate)
+    broadcast = Broadcast(bot, "benchmark", recipients, concurrency=args.concurrency,
+                          global_rate=args.rate, progress_chat_id=0, progress_message_id=0,
+                          progress_interval=1)
+    await broadcast.run()
+    report("engine", args.users, broadcast.finished_at - broadcast.started_at)
+    print(f"engine: sent={broadcast.sent} failed={broadcast.failed} blocked={broadcast.blocked} retried={broadcast.retried} edits={bot.edits}")
+
+class StubBotRequest(BaseRequest):
+    # In-process Bot API: answers every call locally and records when each
+    # chat got its reply, so handler latency can be measured end to end.
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.replied_at = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == 'getMe':
+            result = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif endpoint in ('sendMessage', 'editMessageText'):
+            chat_id = params.get('chat_id')
+            self.replied_at.setdefault(chat_id, time.monotonic())
+            result = {"message_id": 1, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "text": params.get('text', '')}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+def start_update(update_id, chat_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}]
+        }
+    }
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def report_latencies(name, latencies):
+    latencies = sorted(latencies)
+    print(f"{name:<16} p50={percentile(latencies, 0.5) * 1000:7.1f}ms  p99={percentile(latencies, 0.99) * 1000:7.1f}ms  max={percentile(latencies, 1.0) * 1000:7.1f}ms")
+
+async def bench_webhook(args):
+    from aiohttp import ClientSession, web
+    from telegram.ext import Application
+    from database import init_database
+    from main import build_application
+    from webhook import create_webhook_app
+
+    logging.getLogger().setLevel(logging.WARNING)
+    init_database()
+    bot_api = StubBotRequest(args.latency)
+    builder = Application.builder().token("123456:bench").request(bot_api).get_updates_request(StubBotRequest())
+    application = build_application(builder)
+    sent_at = {}
+    ack_latencies = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with application:
+        await application.start()
+        runner = web.AppRunner(create_webhook_app(application, "bench", path="/telegram"))
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        url = f"http://127.0.0.1:{port}/telegram"
+
+        async with ClientSession() as session:
+            async def post(update_id):
+                chat_id = 1000000 + update_id
+                async with semaphore:
+                    started = time.monotonic()
+                    sent_at[chat_id] = started
+                    async with session.post(url, json=start_update(update_id, chat_id), headers={"X-Telegram-Bot-Api-Secret-Token": "bench"}) as response:
+                        await response.read()
+                    ack_latencies.append(time.monotonic() - started)
+
+            started = time.monotonic()
+            await asyncio.gather(*(post(i) for i in range(args.updates)))
+            while len(bot_api.replied_at) < args.updates and time.monotonic() - started < args.timeout:
+                await asyncio.sleep(0.01)
+            elapsed = time.monotonic() - started
+
+        await runner.cleanup()
+        await application.stop()
+
+    handled = [bot_api.replied_at[chat_id] - sent_at[chat_id] for chat_id in bot_api.replied_at if chat_id in sent_at]
+    print(f"webhook    {len(handled)}/{args.updates} updates answered in {elapsed:.2f}s  ->  {len(handled) / elapsed:.1f} updates/s")
+    report_latencies("ack", ack_latencies)
+    report_latencies("end-to-end", handled)
+
+def callback_update(update_id, chat_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": "bench",
+            "data": data,
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": 123456, "is_bot": True, "first_name": "Bench"},
+                "text": "menu"
+            }
+        }
+    }
+
+def command_update(update_id, chat_id, command):
+    update = start_update(update_id, chat_id)
+    update["message"]["text"] = command
+    update["message"]["entities"][0]["length"] = len(command)
+    return update
+
+async def bench_handlers(args):
+    from telegram import Update
+    from telegram.ext import Application
+    from database import init_database, set_pricing_details, set_backup_button
+    from main import build_application, OWNER_ID
+    import handlers
+
+    logging.getLogger().setLevel(logging.WARNING)
+    init_database()
+    set_pricing_details("Benchmark pricing")
+    set_backup_button("https://t.me/bench")
+    # Each bench user sends every scenario back to back; measure the handlers,
+    # not the flood gate turning them away (see the flood benchmark for that).
+    handlers.flood_control.rate = 0
+    handlers.flood_control.dedupe_window = 0
+    builder = Application.builder().token("123456:bench").request(StubBotRequest()).get_updates_request(StubBotRequest())
+    application = build_application(builder)
+    scenarios = [
+        ("/start", lambda i: start_update(i, 2000000 + i % 1000)),
+        ("/help", lambda i: command_update(i, 2000000 + i % 1000, "/help")),
+        ("/admin", lambda i: command_update(i, OWNER_ID, "/admin")),
+        ("help", lambda i: callback_update(i, 2000000 + i % 1000, "help")),
+        ("show_pricing", lambda i: callback_update(i, 2000000 + i % 1000, "show_pricing")),
+        ("get_clone", lambda i: callback_update(i, 2000000 + i % 1000, "get_clone")),
+        ("back_to_admin", lambda i: callback_update(i, OWNER_ID, "back_to_admin")),
+    ]
+    async with application:
+        for name, make_update in scenarios:
+            updates = [Update.de_json(make_update(i), application.bot) for i in range(args.updates)]
+            await application.process_update(updates[0])
+            cpu_started = time.process_time()
+            wall_started = time.perf_counter()
+            for update in updates:
+                await application.process_update(update)
+            cpu = time.process_time() - cpu_started
+            wall = time.perf_counter() - wall_started
+            print(f"{name:<14} {cpu / args.updates * 1e6:8.1f} us CPU/update  {wall / args.updates * 1e6:8.1f} us wall/update")
+
+class FakeBotAPI:
+    # Local stand-in for api.telegram.org, serving any number of bot tokens.
+    # Updates queued with push() are handed out through that bot's getUpdates;
+    # the first sendMessage/editMessageText from the bot to the chat completes
+    # the update the chat is waiting on.
+    def __init__(self):
+        self.updates = {}
+        self.new_updates = {}
+        self.update_id = 0
+        self.polling = asyncio.Event()
+        self.waiting = {}
+        self.calls = {}
+
+    def push(self, token, update):
+        self.update_id += 1
+        update["update_id"] = self.update_id
+        chat_id = (update.get("message") or update["callback_query"]["message"])["chat"]["id"]
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[token, chat_id] = future
+        self.updates.setdefault(token, []).append(update)
+        self.new_updates.setdefault(token, asyncio.Event()).set()
+        return future
+
+    def _reply(self, token, chat_id, text):
+        future = self.waiting.pop((token, chat_id), None)
+        if future and not future.done():
+            future.set_result(time.monotonic())
+        return {"message_id": 1, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "text": text}
+
+    async def _get_updates(self, token, params):
+        offset = int(params.get("offset") or 0)
+        updates = self.updates[token] = [update for update in self.updates.get(token, []) if update["update_id"] >= offset]
+        if not updates:
+            new_updates = self.new_updates.setdefault(token, asyncio.Event())
+            new_updates.clear()
+            try:
+                await asyncio.wait_for(new_updates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[token][:int(params.get("limit") or 100)]
+
+    async def handle(self, request):
+        from aiohttp import web
+        token = request.match_info["token"]
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getMe":
+            bot_id = int(token.split(":")[0])
+            result = {"id": bot_id, "is_bot": True, "first_name": "Bench", "username": f"bench{bot_id}_bot"}
+        elif method == "getUpdates":
+            self.polling.set()
+            result = await self._get_updates(token, params)
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._reply(token, int(params["chat_id"]), params.get("text", ""))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host="127.0.0.1", port=0):
+        from aiohttp import web
+        web_app = web.Application()
+        web_app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(web_app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        return f"http://{host}:{self.runner.addresses[0][1]}/bot"
+
+LOAD_BOT_TOKEN = "123456:load"
+LOAD_DB_NAME = "bench_load"
+LOAD_SCENARIOS = {
+    "start": lambda chat_id: start_update(0, chat_id),
+    "help_command": lambda chat_id: command_update(0, chat_id, "/help"),
+    "help": lambda chat_id: callback_update(0, chat_id, "help"),
+    "show_pricing": lambda chat_id: callback_update(0, chat_id, "show_pricing"),
+    "get_clone": lambda chat_id: callback_update(0, chat_id, "get_clone"),
+}
+ADMIN_FLOW = [
+    ("admin", lambda chat_id: command_update(0, chat_id, "/admin")),
+    ("admin_stats", lambda chat_id: callback_update(0, chat_id, "admin_stats")),
+    ("admin_view_keys", lambda chat_id: callback_update(0, chat_id, "admin_view_keys")),
+    ("back_to_admin", lambda chat_id: callback_update(0, chat_id, "back_to_admin")),
+]
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in LOAD_SCENARIOS and name != "admin_flow":
+            raise SystemExit(f"Unknown scenario {name!r}; choose from {', '.join([*LOAD_SCENARIOS, 'admin_flow'])}")
+        weights[name] = float(weight or 1)
+    return weights
+
+async def bench_load(args):
+    # Runs the real entry point (main.main(), long polling) in a child process
+    # against FakeBotAPI, so nothing leaves the machine.
+    weights = parse_mix(args.mix)
+    random.seed(args.seed)
+    fake_api = FakeBotAPI()
+    base_url = await fake_api.start()
+    if args.uri:
+        MongoClient(args.uri).drop_database(LOAD_DB_NAME)
+    env = dict(os.environ, BOT_TOKEN=LOAD_BOT_TOKEN, BOT_API_URL=base_url, MONGO_URI=args.uri or "mongomock://",
+               MONGO_DB_NAME=LOAD_DB_NAME, OWNER_ID=str(args.owner_id), BOT_MODE="polling", METRICS_PORT="0")
+    bot_dir = os.path.dirname(os.path.abspath(__file__))
+    output = None if args.show_bot_logs else asyncio.subprocess.DEVNULL
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", "import main; main.main()", cwd=bot_dir, env=env, stdout=output, stderr=output)
+
+    latencies = {}
+    timeouts = {}
+    free_chats = asyncio.Queue()
+    for chat_id in range(3000000, 3000000 + args.users):
+        free_chats.put_nowait(chat_id)
+    owner_lock = asyncio.Lock()
+
+    async def send(name, make_update, chat_id):
+        sent_at = time.monotonic()
+        try:
+            replied_at = await asyncio.wait_for(fake_api.push(LOAD_BOT_TOKEN, make_update(chat_id)), args.timeout)
+            latencies.setdefault(name, []).append(replied_at - sent_at)
+        except asyncio.TimeoutError:
+            fake_api.waiting.pop((LOAD_BOT_TOKEN, chat_id), None)
+            timeouts[name] = timeouts.get(name, 0) + 1
+
+    async def user_session(name):
+        chat_id = await free_chats.get()
+        try:
+            await send(name, LOAD_SCENARIOS[name], chat_id)
+        finally:
+            free_chats.put_nowait(chat_id)
+
+    async def admin_session():
+        async with owner_lock:
+            for name, make_update in ADMIN_FLOW:
+                await send(name, make_update, args.owner_id)
+
+    try:
+        await asyncio.wait_for(fake_api.polling.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        raise SystemExit("Bot did not start polling; rerun with --show-bot-logs")
+
+    names, cumulative = list(weights), list(weights.values())
+    sessions = []
+    started = time.monotonic()
+    for i in range(int(args.rate * args.duration)):
+        await asyncio.sleep(max(0.0, started + i / args.rate - time.monotonic()))
+        name = random.choices(names, cumulative)[0]
+        sessions.append(asyncio.create_task(admin_session() if name == "admin_flow" else user_session(name)))
+    await asyncio.gather(*sessions)
+    elapsed = time.monotonic() - started
+
+    process.send_signal(signal.SIGINT)
+    try:
+        await asyncio.wait_for(process.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+    await fake_api.runner.cleanup()
+    if args.uri:
+        MongoClient(args.uri).drop_database(LOAD_DB_NAME)
+
+    answered = sum(len(values) for values in latencies.values())
+    print(f"load       {answered} updates answered in {elapsed:.2f}s  ->  {answered / elapsed:.1f} updates/s (offered {args.rate:g}/s)")
+    for name, values in sorted(latencies.items()):
+        report_latencies(name, values)
+    report_latencies("all", [value for values in latencies.values() for value in values])
+    if timeouts:
+        print("timeouts   " + ", ".join(f"{name}={count}" for name, count in sorted(timeouts.items())))
+    print("api calls  " + ", ".join(f"{method}={count}" for method, count in sorted(fake_api.calls.items())))
+
+async def bench_redeem(args):
+    import database
+    from async_database import verify_auth_key, mark_auth_key_used, redeem_auth_key, revoke_auth_key
+
+    # mongomock's find_one_and_update is not atomic across threads, so a run
+    # against it would prove nothing either way.
+    bench_db, is_mock = connect_bench_db(args.uri)
+    if is_mock:
+        bench_db.client.close()
+        raise SystemExit("redeem needs --uri pointing at a real mongod: mongomock cannot show whether redemption is atomic.")
+    bench_db.client.drop_database(bench_db.name)
+    ensure_indexes(bench_db)
+    # MONGO_URI is pinned to mongomock above, so hand the module this client and
+    # a tenant on the bench database; otherwise run_in_transaction and
+    # tenants_collection would never touch the real server.
+    database._client = bench_db.client
+    database._transactions_supported = None
+    tenant = database.Tenant("bench_redeem", 0, bench_db.name)
+    database.use_tenant(tenant)
+    database.tenants_collection = database.TenantCollection('tenants', tenant)
+    failures = []
+
+    async def two_step(auth_key, user_id):
+        if await verify_auth_key(auth_key):
+            await mark_auth_key_used(auth_key, user_id)
+            return True
+        return False
+
+    async def atomic(auth_key, user_id):
+        return await redeem_auth_key(auth_key, user_id) is not None
+
+    for label, redeem in (("verify+mark", two_step), ("atomic", atomic)):
+        keys = [database.generate_auth_key(i, f"buyer{i}") for i in range(args.keys)]
+        started = time.perf_counter()
+        results = await asyncio.gather(*(redeem(key, user_id) for key in keys for user_id in range(args.redeemers)))
+        elapsed = time.perf_counter() - started
+        per_key = [sum(results[i * args.redeemers:(i + 1) * args.redeemers]) for i in range(args.keys)]
+        double = sum(1 for wins in per_key if wins > 1)
+        print(f"{label:<12} {len(results):>6} attempts in {elapsed:6.2f}s  keys redeemed more than once: {double}/{args.keys}")
+        # verify+mark is the old racy path, shown for comparison only.
+        if redeem is atomic and double:
+            failures.append(f"{double} keys redeemed more than once")
+
+    old_keys = [database.generate_auth_key(i, f"buyer{i}") for i in range(args.keys)]
+    bench_db.tenants.insert_many([{"_id": f"bench{i}", "auth_key": key, "active": True} for i, key in enumerate(old_keys)])
+    results = await asyncio.gather(*(revoke_auth_key(key) for key in old_keys for _ in range(args.redeemers)))
+    reissued = sum(1 for new_key in results if new_key)
+    live = bench_db.auth_keys.count_documents({"purchaser_id": {"$in": list(range(args.keys))}, "is_revoked": False, "is_used": False})
+    active = bench_db.tenants.count_documents({"active": True})
+    path = "transaction" if database._transactions_supported else "no transaction"
+    print(f"{'revoke':<12} {len(results):>6} attempts  reissued keys: {reissued} for {args.keys} revoked keys ({live} live unused keys, {active} clones left active, {path})")
+    if reissued != args.keys:
+        failures.append(f"{reissued} keys reissued for {args.keys} revoked keys")
+    if active:
+        failures.append(f"{active} clones left active after their key was revoked")
+    bench_db.client.drop_database(bench_db.name)
+    if failures:
+        raise SystemExit("FAILED: " + "; ".join(failures))
+    print("ok         every key redeemed and revoked exactly once")
+
+def linear_resolve(data):
+    # The if/elif chain button_handler used before the routing table, kept as a
+    # baseline. Like the old branches, prefixed routes also split out their payload.
+    if data == "help":
+        return "help", ""
+    elif data == "show_pricing":
+        return "show_pricing", ""
+    elif data == "get_clone":
+        return "get_clone", ""
+    elif data.startswith("admin_"):
+        for name in ("admin_stats", "admin_generate_key", "admin_view_keys", "admin_view_cloners", "admin_ban_user",
+                     "admin_unban_user", "admin_set_backup", "admin_remove_backup", "admin_set_pricing",
+                     "admin_remove_pricing", "admin_broadcast"):
+            if data == name:
+                return name, ""
+    elif data == "back_to_admin":
+        return "back_to_admin", ""
+    elif data.startswith("page:"):
+        return "page:", data.split(":", 1)[1]
+    elif data.startswith("unban_"):
+        return "unban_", data.split("_", 1)[1]
+    elif data.startswith("revoke_"):
+        return "revoke_", data.split("revoke_", 1)[1]
+    return "other", None
+
+async def bench_dispatch(args):
+    from handlers import resolve_callback, CALLBACK_ROUTES
+
+    samples = list(CALLBACK_ROUTES) + [
+        "page:keys:next:65f000000000000000000000",
+        "unban_123456789",
+        f"revoke_{uuid.uuid4()}",
+        "unknown_payload",
+    ]
+    print(f"{'callback':<24} {'if/elif':>10} {'router':>10}")
+    for data in samples:
+        timings = [
+            min(timeit.repeat(functools.partial(resolve, data), number=args.iterations, repeat=5)) / args.iterations * 1e9
+            for resolve in (linear_resolve, resolve_callback)
+        ]
+        print(f"{data[:24]:<24} {timings[0]:8.1f}ns {timings[1]:8.1f}ns")
+
+async def bench_flood(args):
+    from telegram import Update
+    from telegram.ext import Application
+    from database import init_database
+    from flood_control import FloodControl
+    from main import build_application
+    from metrics import DB_LATENCY, THROTTLED_UPDATES
+
+    logging.getLogger().setLevel(logging.WARNING)
+    init_database()
+    builder = Application.builder().token("123456:bench").request(StubBotRequest()).get_updates_request(StubBotRequest())
+    application = build_application(builder)
+
+    def db_calls():
+        return sum(sum(series[:-1]) for series in DB_LATENCY.series.values())
+
+    spammer = 3000000
+    scenarios = [
+        ("/start spam", lambda i: start_update(i, spammer)),
+        ("tap spam", lambda i: callback_update(i, spammer + 1, "help")),
+        ("distinct users", lambda i: start_update(i, spammer + 2 + i)),
+    ]
+    async with application:
+        for name, make_update in scenarios:
+            updates = [Update.de_json(make_update(i), application.bot) for i in range(args.updates)]
+            throttled_before = sum(THROTTLED_UPDATES.values.values())
+            calls_before = db_calls()
+            started = time.perf_counter()
+            for update in updates:
+                await application.process_update(update)
+            elapsed = time.perf_counter() - started
+            throttled = sum(THROTTLED_UPDATES.values.values()) - throttled_before
+            print(f"{name:<16} {args.updates - throttled:>6} passed {throttled:>6} throttled {db_calls() - calls_before:>6} DB calls"
+                  f"  {elapsed / args.updates * 1e6:8.1f} us/update")
+    print("throttled  " + ", ".join(f"{key[0]}={count}" for key, count in sorted(THROTTLED_UPDATES.values.items())))
+
+    flood_control = FloodControl(max_users=args.max_users)
+    for user_id in range(args.max_users * 10):
+        flood_control.allow(user_id)
+    print(f"lru        {args.max_users * 10} distinct users -> {len(flood_control.buckets)} buckets kept")
+
+async def bench_snapshot(args):
+    import tempfile
+    import database
+
+    logging.getLogger().setLevel(logging.WARNING)
+    context_token = database.use_tenant(database.Tenant("snapshot_source", 0))
+    now = datetime.now()
+    for start in range(0, args.users, database.DB_BATCH_SIZE):
+        database.users_collection.insert_many([
+            {"user_id": i, "username": f"user{i}", "first_name": f"User {i}", "is_banned": False, "joined_date": now, "last_seen": now}
+            for i in range(start, min(start + database.DB_BATCH_SIZE, args.users))
+        ])
+    database.generate_auth_keys([(i, f"buyer{i}") for i in range(args.keys)])
+    database.ban_users(range(0, args.users, 50))
+
+    with tempfile.TemporaryFile() as snapshot:
+        started = time.perf_counter()
+        counts = database.export_snapshot(snapshot)
+        elapsed = time.perf_counter() - started
+        rows = sum(counts.values())
+        print(f"export     {rows} rows in {elapsed:.2f}s ({rows / elapsed:.0f} rows/s), {snapshot.tell() / rows:.1f} bytes/row gzipped")
+        database.reset_tenant(context_token)
+        context_token = database.use_tenant(database.Tenant("snapshot_target", 0))
+        for name in ("import", "reimport"):
+            snapshot.seek(0)
+            started = time.perf_counter()
+            counts, invalid, _ = database.import_snapshot(snapshot)
+            elapsed = time.perf_counter() - started
+            print(f"{name:<10} {rows / elapsed:8.0f} rows/s  " + ", ".join(
+                f"{collection} +{count['inserted']} ={count['skipped']}" for collection, count in counts.items()))
+    stats = database.get_user_stats()
+    print(f"stats      {stats['total_users']} users, {stats['banned_users']} banned after import")
+    database.reset_tenant(context_token)
+
+async def bench_tenants(args):
+    import gc
+    import resource
+    import tracemalloc
+    import database
+    from telegram.ext import Application
+    from clone_host import CloneHost
+    from main import build_application
+
+    logging.getLogger().setLevel(logging.WARNING)
+    fake_api = FakeBotAPI()
+    base_url = await fake_api.start()
+    host = CloneHost(build_application, lambda token: Application.builder().token(token).base_url(base_url))
+    tokens = [f"{700000 + i}:{uuid.uuid4().hex}" for i in range(args.tenants)]
+    keys = database.generate_auth_keys([(i, f"buyer{i}") for i in range(args.tenants)])
+    for i, (auth_key, token) in enumerate(zip(keys, tokens)):
+        database.redeem_clone(auth_key, 5000000 + i, token)
+
+    gc.collect()
+    tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    await host.sync()
+    startup = time.perf_counter() - started
+    gc.collect()
+    traced, _ = tracemalloc.get_traced_memory()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.stop()
+    print(f"tenants    {len(host.tenants)} clones started in {startup:.2f}s ({startup / args.tenants * 1000:.1f} ms each)")
+    print(f"memory     {traced / args.tenants / 1024:8.1f} KiB/tenant traced by Python, {(rss_after - rss_before) / args.tenants:8.1f} KiB/tenant peak RSS growth")
+
+    latencies = []
+    for round_number in range(args.rounds):
+        sent_at = time.monotonic()
+        replies = await asyncio.wait_for(asyncio.gather(*(
+            fake_api.push(token, start_update(0, 9000000 + round_number)) for token in tokens
+        )), args.timeout)
+        latencies.extend(replied_at - sent_at for replied_at in replies)
+    report_latencies("/start", latencies)
+
+    started = time.perf_counter()
+    for name in list(host.tenants):
+        await host.remove(name)
+    print(f"stop       all clones stopped in {time.perf_counter() - started:.2f}s")
+    await fake_api.runner.cleanup()
+
+def connect_bench_db(uri):
+    if uri and not uri.startswith('mongomock://'):
+        return MongoClient(uri)['bench_indexes'], False
+    import mongomock
+    return mongomock.MongoClient()['bench_indexes'], True
+
+def time_queries(name, queries):
+    started = time.perf_counter()
+    for query in queries:
+        query()
+    elapsed = time.perf_counter() - started
+    print(f"{name:<30} {len(queries):>6} queries  ->  {elapsed / len(queries) * 1e6:10.1f} us/query")
+
+async def bench_indexes(args):
+    bench_db, is_mock = connect_bench_db(args.uri)
+    if is_mock:
+        print("No --uri given: using mongomock, which scans regardless of indexes.")
+    bench_db.client.drop_database(bench_db.name)
+    now = datetime.now()
+    bench_db.users.insert_many(
+        {"user_id": i, "first_name": f"user{i}", "is_banned": i % 50 == 0, "last_seen": now, "joined_date": now}
+        for i in range(args.users)
+    )
+    keys = [str(uuid.uuid4()) for _ in range(args.keys)]
+    bench_db.auth_keys.insert_many(
+        {"auth_key": key, "purchaser_id": i, "purchaser_name": f"buyer{i}", "created_at": now,
+         "is_used": i % 3 == 0, "is_revoked": False}
+        for i, key in enumerate(keys)
+    )
+    user_ids = [random.randrange(args.users) for _ in range(args.queries)]
+    sampled_keys = [random.choice(keys) for _ in range(args.queries)]
+
+    def run(label):
+        time_queries(f"{label} users.user_id", [lambda u=u: bench_db.users.find_one({"user_id": u}) for u in user_ids])
+        time_queries(f"{label} auth_keys.auth_key", [lambda k=k: bench_db.auth_keys.find_one({"auth_key": k, "is_revoked": False}) for k in sampled_keys])
+        time_queries(f"{label} banned users page", [lambda: list(bench_db.users.find({"is_banned": True}).sort("_id", 1).limit(50))] * 20)
+
+    run("no index:")
+    ensure_indexes(bench_db)
+    run("indexed: ")
+    bench_db.client.drop_database(bench_db.name)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the bot")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    broadcast_parser = subparsers.add_parser("broadcast", help="Serial send loop vs. broadcast engine against a fake bot")
+    broadcast_parser.add_argument("--users", type=int, default=300)
+    broadcast_parser.add_argument("--latency", type=float, default=0.1, help="Simulated Bot API round-trip in seconds")
+    broadcast_parser.add_argument("--rate", type=float, default=25, help="Global send rate for the engine (msg/s)")
+    broadcast_parser.add_argument("--concurrency", type=int, default=20)
+    broadcast_parser.add_argument("--retry-after-rate", type=float, default=0.0)
+    broadcast_parser.add_argument("--blocked-rate", type=float, default=0.01)
+    broadcast_parser.add_argument("--seed", type=int, default=1)
+    broadcast_parser.add_argument("--skip-serial", action="store_true")
+    broadcast_parser.set_defaults(func=bench_broadcast)
+
+    indexes_parser = subparsers.add_parser("indexes", help="Query latency with and without the startup indexes")
+    indexes_parser.add_argument("--uri", help="Local mongod to use (mongomock when unset)")
+    indexes_parser.add_argument("--users", type=int, default=50000)
+    indexes_parser.add_argument("--keys", type=int, default=5000)
+    indexes_parser.add_argument("--queries", type=int, default=500)
+    indexes_parser.set_defaults(func=bench_indexes)
+
+    webhook_parser = subparsers.add_parser("webhook", help="POST synthetic /start updates at the webhook server and time the replies")
+    webhook_parser.add_argument("--updates", type=int, default=2000)
+    webhook_parser.add_argument("--concurrency", type=int, default=50, help="Parallel in-flight POSTs")
+    webhook_parser.add_argument("--latency", type=float, default=0.0, help="Simulated Bot API round-trip in seconds")
+    webhook_parser.add_argument("--timeout", type=float, default=60.0)
+    webhook_parser.set_defaults(func=bench_webhook)
+
+    handlers_parser = subparsers.add_parser("handlers", help="CPU time per update for each handler path with a stub Bot API")
+    handlers_parser.add_argument("--updates", type=int, default=2000)
+    handlers_parser.set_defaults(func=bench_handlers)
+
+    redeem_parser = subparsers.add_parser("redeem", help="Parallel redeemers and revokers racing for the same auth keys")
+    redeem_parser.add_argument("--uri", help="Local mongod to use (required)")
+    redeem_parser.add_argument("--keys", type=int, default=200)
+    redeem_parser.add_argument("--redeemers", type=int, default=16, help="Concurrent attempts per key")
+    redeem_parser.set_defaults(func=bench_redeem)
+
+    dispatch_parser = subparsers.add_parser("dispatch", help="Callback dispatch cost per callback type, routing table vs. if/elif chain")
+    dispatch_parser.add_argument("--iterations", type=int, default=200000)
+    dispatch_parser.set_defaults(func=bench_dispatch)
+
+    flood_parser = subparsers.add_parser("flood", help="One user spamming /start and button taps against the flood gate")
+    flood_parser.add_argument("--updates", type=int, default=2000)
+    flood_parser.add_argument("--max-users", type=int, default=10000, help="LRU size for the memory check")
+    flood_parser.set_defaults(func=bench_flood)
+
+    snapshot_parser = subparsers.add_parser("snapshot", help="Export users, keys and bans to a snapshot and import it twice into another tenant")
+    snapshot_parser.add_argument("--users", type=int, default=20000)
+    snapshot_parser.add_argument("--keys", type=int, default=2000)
+    snapshot_parser.set_defaults(func=bench_snapshot)
+
+    tenants_parser = subparsers.add_parser("tenants", help="Start many clones in one clone host and report memory per tenant")
+    tenants_parser.add_argument("--tenants", type=int, default=50)
+    tenants_parser.add_argument("--rounds", type=int, default=5, help="/start updates sent to every clone after startup")
+    tenants_parser.add_argument("--timeout", type=float, default=60.0)
+    tenants_parser.set_defaults(func=bench_tenants)
+
+    load_parser = subparsers.add_parser("load", help="Run main.main() against a local fake Bot API and replay a traffic mix")
+    load_parser.add_argument("--rate", type=float, default=100, help="Offered updates (or admin flows) per second")
+    load_parser.add_argument("--duration", type=float, default=10)
+    load_parser.add_argument("--mix", default="start=60,help_command=5,help=10,show_pricing=10,get_clone=10,admin_flow=5",
+                             help="Comma separated scenario=weight pairs")
+    load_parser.add_argument("--users", type=int, default=5000, help="Distinct user chats to draw from")
+    load_parser.add_argument("--owner-id", type=int, default=42)
+    load_parser.add_argument("--uri", help=f"Local mongod for the bot, used with the throwaway {LOAD_DB_NAME} database (mongomock when unset)")
+    load_parser.add_argument("--timeout", type=float, default=30.0)
+    load_parser.add_argument("--seed", type=int, default=1)
+    load_parser.add_argument("--show-bot-logs", action="store_true")
+    load_parser.set_defaults(func=bench_load)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+if __name__ == '__main__':
+    main()
+"""
+
+# 10. async_database.py content
+async_database_py = r"""import os
+import asyncio
+import contextvars
+import functools
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import time
+import database
+from database import ORIGINAL_BOT_CREATOR_ID, ORIGINAL_BOT_CREATOR_NAME
+from metrics import DB_LATENCY, Gauge
+
+logger = logging.getLogger(__name__)
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '16'))
+
+# pymongo is blocking, so every call runs on this bounded pool instead of the
+# event loop; its size also caps how many Mongo round-trips are in flight.
+executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix='mongo')
+
+Gauge("bot_db_executor_queue_depth", "MongoDB calls waiting for a pool thread", function=lambda: executor._work_queue.qsize())
+Gauge("bot_user_buffer_depth", "Buffered user updates awaiting a flush", function=lambda: database.get_write_buffer_metrics()["depth"])
+Gauge("bot_user_buffer_last_flush_seconds", "Duration of the last user buffer flush", function=lambda: database.get_write_buffer_metrics()["last_flush_seconds"])
+Gauge("bot_user_buffer_flushes", "User buffer flushes since start", function=lambda: database.get_write_buffer_metrics()["flushes"])
+
+async def run_sync(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(ctx.run, func, *args, **kwargs))
+
+async def _timed_run(operation, func, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return await run_sync(func, *args, **kwargs)
+    finally:
+        DB_LATENCY.observe(time.perf_counter() - started, operation=operation)
+
+def _offload(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await _timed_run(func.__name__, func, *args, **kwargs)
+    return wrapper
+
+def _offload_cached(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if database.settings_cached():
+            return func(*args, **kwargs)
+        return await _timed_run(func.__name__, func, *args, **kwargs)
+    return wrapper
+
+def _inline(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+    return wrapper
+
+def _offload_iter(iter_func):
+    @functools.wraps(iter_func)
+    async def wrapper(*args, **kwargs):
+        iterator = iter_func(*args, **kwargs)
+        while True:
+            chunk = await _timed_run(iter_func.__name__, list, itertools.islice(iterator, database.DB_BATCH_SIZE))
+            if not chunk:
+                return
+            for item in chunk:
+                yield item
+    return wrapper
+
+current_tenant = database.current_tenant
+default_tenant = database.default_tenant
+SNAPSHOT_COLLECTIONS = database.SNAPSHOT_COLLECTIONS
+
+init_database = _offload(database.init_database)
+warm_up = _offload(database.warm_up)
+load_banned_ids = _offload(database.load_banned_ids)
+get_user_stats = _offload(database.get_user_stats)
+get_user_data = _offload(database.get_user_data)
+get_conversation_state = _offload(database.get_conversation_state)
+set_conversation_state = _offload(database.set_conversation_state)
+delete_conversation_state = _offload(database.delete_conversation_state)
+flush_user_data = _offload(database.flush_user_data)
+get_write_buffer_metrics = _inline(database.get_write_buffer_metrics)
+
+async def close_database():
+    # Last step of shutdown: let queued calls finish, then drop the sockets.
+    await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+    database.close_client()
+
+async def save_user_data(user_id, username, first_name):
+    if database.buffer_user_data(user_id, username, first_name) >= database.USER_FLUSH_SIZE:
+        await flush_user_data()
+
+async def user_flush_loop():
+    while True:
+        await asyncio.sleep(database.USER_FLUSH_INTERVAL)
+        try:
+            await flush_user_data()
+        except Exception as e:
+            logger.error("Flushing buffered user updates failed: %s", e)
+
+async def banned_ids_refresh_loop():
+    if database.BAN_CACHE_TTL <= 0:
+        return
+    while True:
+        await asyncio.sleep(database.BAN_CACHE_TTL)
+        try:
+            await load_banned_ids(reload=True)
+        except Exception as e:
+            logger.error("Reloading banned users failed: %s", e)
+
+ban_user = _offload(database.ban_user)
+unban_user = _offload(database.unban_user)
+ban_users = _offload(database.ban_users)
+unban_users = _offload(database.unban_users)
+is_user_banned = _inline(database.is_user_banned)
+generate_auth_key = _offload(database.generate_auth_key)
+generate_auth_keys = _offload(database.generate_auth_keys)
+verify_auth_key = _offload(database.verify_auth_key)
+redeem_auth_key = _offload(database.redeem_auth_key)
+mark_auth_key_used = _offload(database.mark_auth_key_used)
+revoke_auth_key = _offload(database.revoke_auth_key)
+redeem_clone = _offload(database.redeem_clone)
+create_broadcast_job = _offload(database.create_broadcast_job)
+claim_broadcast_job = _offload(database.claim_broadcast_job)
+checkpoint_broadcast_job = _offload(database.checkpoint_broadcast_job)
+set_broadcast_status = _offload(database.set_broadcast_status)
+get_active_broadcast_jobs = _offload(database.get_active_broadcast_jobs)
+list_active_tenants = _offload(database.list_active_tenants)
+deactivate_tenant = _offload(database.deactivate_tenant)
+get_backup_button = _offload_cached(database.get_backup_button)
+set_backup_button = _offload(database.set_backup_button)
+remove_backup_button = _offload(database.remove_backup_button)
+get_pricing_details = _offload_cached(database.get_pricing_details)
+set_pricing_details = _offload(database.set_pricing_details)
+remove_pricing_details = _offload(database.remove_pricing_details)
+
+get_auth_keys_page = _offload(database.get_auth_keys_page)
+get_cloners_page = _offload(database.get_cloners_page)
+get_banned_users_page = _offload(database.get_banned_users_page)
+
+export_snapshot = _offload(database.export_snapshot)
+import_snapshot = _offload(database.import_snapshot)
+
+iter_users = _offload_iter(database.iter_users)
+iter_recipient_ids = _offload_iter(database.iter_recipient_ids)
+iter_recipients = _offload_iter(database.iter_recipients)
+iter_banned_users = _offload_iter(database.iter_banned_users)
+iter_auth_keys = _offload_iter(database.iter_auth_keys)
+iter_cloners = _offload_iter(database.iter_cloners)
+"""
+
+# 11. webhook.py content
+webhook_py = r"""import os
+import asyncio
+import logging
+import secrets
+import signal
+import ssl
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', os.environ.get('PORT', '8080')))
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+WEBHOOK_CERT = os.environ.get('WEBHOOK_CERT')
+WEBHOOK_KEY = os.environ.get('WEBHOOK_KEY')
+HEALTH_PATH = os.environ.get('HEALTH_PATH', '/healthz')
+
+def create_webhook_app(application, secret_token, path=WEBHOOK_PATH):
+    # Without the secret anyone reaching the port could post updates claiming
+    # to come from the owner, so there is no unauthenticated mode.
+    if not secret_token:
+        raise ValueError("A webhook secret token is required")
+    expected_secret = secret_token.encode()
+
+    async def handle_update(request):
+        # Bytes, since compare_digest rejects non-ASCII str from a forged header.
+        received_secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '').encode('utf-8', 'surrogateescape')
+        if not secrets.compare_digest(received_secret, expected_secret):
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(data, dict):
+            return web.Response(status=400)
+        try:
+            update = Update.de_json(data, application.bot)
+        except (KeyError, TypeError, ValueError):
+            return web.Response(status=400)
+        # Acknowledge as soon as the update is queued; handlers run concurrently
+        # and Telegram only needs the 200 to stop retrying.
+        await application.update_queue.put(update)
+        return web.Response()
+
+    async def health(request):
+        return web.json_response({
+            "status": "ok" if application.running else "starting",
+            "update_queue": application.update_queue.qsize()
+        })
+
+    web_app = web.Application()
+    web_app.router.add_post(path, handle_update)
+    web_app.router.add_get(HEALTH_PATH, health)
+    return web_app
+
+def _ssl_context():
+    # Usually TLS ends at the load balancer and we serve plain HTTP behind it;
+    # set WEBHOOK_CERT/WEBHOOK_KEY only when Telegram connects to us directly.
+    if not (WEBHOOK_CERT and WEBHOOK_KEY):
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(WEBHOOK_CERT, WEBHOOK_KEY)
+    return context
+
+async def serve_webhook(application, drop_pending_updates=False):
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL must be set to run in webhook mode")
+    # A generated secret is only known to this process and Telegram; it changes
+    # on every start, which is fine since set_webhook re-registers it.
+    secret_token = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=drop_pending_updates
+        )
+        await application.start()
+
+        runner = web.AppRunner(create_webhook_app(application, secret_token))
+        await runner.setup()
+        site = web.TCPSite(runner, WEBHOOK_LISTEN, WEBHOOK_PORT, ssl_context=_ssl_context())
+        await site.start()
+        logger.info("Webhook listening on %s:%d%s", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+
+        await stop_event.wait()
+        await runner.cleanup()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+"""
+
+# 12. state_store.py content
+state_store_py = r"""import os
+import time
+from collections import OrderedDict
+import async_database
+
+STATE_BACKEND = os.environ.get('STATE_BACKEND', 'memory').lower()
+STATE_TTL = float(os.environ.get('STATE_TTL', '900'))
+STATE_MAX_ENTRIES = int(os.environ.get('STATE_MAX_ENTRIES', '10000'))
+
+class MemoryStateStore:
+    def __init__(self, ttl=STATE_TTL, max_entries=STATE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    # Keyed by tenant as well, since one person may own several hosted bots.
+    async def get(self, user_id):
+        key = (async_database.current_tenant().name, user_id)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, state = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return state
+
+    async def set(self, user_id, state):
+        key = (async_database.current_tenant().name, user_id)
+        self.entries[key] = (time.monotonic() + self.ttl, state)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def delete(self, user_id):
+        self.entries.pop((async_database.current_tenant().name, user_id), None)
+
+class MongoStateStore:
+    # Shared by every replica and survives restarts; expired flows are removed
+    # by the TTL index on expires_at.
+    def __init__(self, ttl=STATE_TTL):
+        self.ttl = ttl
+
+    async def get(self, user_id):
+        return await async_database.get_conversation_state(user_id)
+
+    async def set(self, user_id, state):
+        await async_database.set_conversation_state(user_id, state, self.ttl)
+
+    async def delete(self, user_id):
+        await async_database.delete_conversation_state(user_id)
+
+def create_state_store(backend=STATE_BACKEND):
+    if backend == 'mongo':
+        return MongoStateStore()
+    if backend == 'memory':
+        return MemoryStateStore()
+    raise ValueError(f"Unknown STATE_BACKEND: {backend}")
+"""
+
+# 13. render.py content
+render_py = r"""from functools import lru_cache
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from async_database import get_user_data, ORIGINAL_BOT_CREATOR_ID, ORIGINAL_BOT_CREATOR_NAME
+
+# Everything here is built once, or once per distinct setting value, and the
+# resulting (immutable) markups are shared by every update.
+
+HELP_TEXT = "ℹ️ **Bot Help**\n\nAvailable Commands:\n/start - Start the bot\n/help - Show this help message\n/admin - Admin panel (Owner only)\n/clone <auth key> <bot token> - Start the bot clone you purchased\n\nFor any questions, contact the bot owner."
+
+ADMIN_PANEL_TEXT = "🔐 **Admin Panel**\n\nBulk actions: /ban or /unban followed by user IDs, /genkeys followed by `id,name` lines, or a CSV file with the command as its caption.\n\nBackups: /export sends a snapshot file; send it back with /import as its caption to restore it or move it to another bot.\n\nSelect an option:"
+
+ADMIN_PANEL_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("👥 User Stats", callback_data="admin_stats")],
+    [InlineKeyboardButton("🔑 Generate Auth Key", callback_data="admin_generate_key")],
+    [InlineKeyboardButton("📋 View Auth Keys", callback_data="admin_view_keys")],
+    [InlineKeyboardButton("👥 View Cloners", callback_data="admin_view_cloners")],
+    [InlineKeyboardButton("🚫 Ban User", callback_data="admin_ban_user")],
+    [InlineKeyboardButton("✅ Unban User", callback_data="admin_unban_user")],
+    [InlineKeyboardButton("📥 Set Backup Button", callback_data="admin_set_backup")],
+    [InlineKeyboardButton("🗑️ Remove Backup Button", callback_data="admin_remove_backup")],
+    [InlineKeyboardButton("💰 Set Pricing Details", callback_data="admin_set_pricing")],
+    [InlineKeyboardButton("🗑️ Remove Pricing Details", callback_data="admin_remove_pricing")],
+    [InlineKeyboardButton("📢 Broadcast", callback_data="admin_broadcast")],
+    [InlineKeyboardButton("📋 Broadcast Jobs", callback_data="admin_broadcast_jobs")],
+    [InlineKeyboardButton("💾 Export Data", callback_data="admin_export")],
+])
+
+BACK_TO_ADMIN_BUTTON = InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="back_to_admin")
+BACK_TO_ADMIN_MARKUP = InlineKeyboardMarkup([[BACK_TO_ADMIN_BUTTON]])
+
+BROADCAST_STATUS_LABELS = {
+    "queued": "⏳ Queued",
+    "running": "📢 Sending",
+    "paused": "⏸️ Paused",
+    "cancelled": "✖️ Cancelled",
+    "done": "✅ Completed",
+}
+
+_owner_names = {}
+
+async def get_owner_name(owner_id):
+    if owner_id == ORIGINAL_BOT_CREATOR_ID:
+        return ORIGINAL_BOT_CREATOR_NAME
+    if owner_id not in _owner_names:
+        owner_data = await get_user_data(owner_id)
+        _owner_names[owner_id] = owner_data.get('first_name', 'Owner') if owner_data else 'Owner'
+    return _owner_names[owner_id]
+
+def update_owner_name(owner_id, first_name):
+    _owner_names[owner_id] = first_name or 'Owner'
+
+def broadcast_controls_markup(job_id, status, label=""):
+    if status in ("queued", "running"):
+        toggle = InlineKeyboardButton(f"⏸️ Pause{label}", callback_data=f"bcast:pause:{job_id}")
+    elif status == "paused":
+        toggle = InlineKeyboardButton(f"▶️ Resume{label}", callback_data=f"bcast:resume:{job_id}")
+    else:
+        return None
+    return InlineKeyboardMarkup([[toggle, InlineKeyboardButton(f"✖️ Cancel{label}", callback_data=f"bcast:cancel:{job_id}")]])
+
+def broadcast_job_view(job):
+    text = f"{BROADCAST_STATUS_LABELS[job['status']]} broadcast\n\n📤 Sent: {job['sent']}\n❌ Failed: {job['failed']}\n🚫 Blocked: {job['blocked']}"
+    return text, broadcast_controls_markup(job['_id'], job['status'])
+
+def broadcast_jobs_view(jobs):
+    if not jobs:
+        return "📋 No queued, running or paused broadcasts.", BACK_TO_ADMIN_MARKUP
+    lines = []
+    keyboard = []
+    for number, job in enumerate(jobs, 1):
+        lines.append(f"#{number} {BROADCAST_STATUS_LABELS[job['status']]} (created {job['created_at']:%Y-%m-%d %H:%M} UTC)\n📤 {job['sent']} sent, ❌ {job['failed']} failed")
+        keyboard.extend(broadcast_controls_markup(job['_id'], job['status'], f" #{number}").inline_keyboard)
+    keyboard.append([BACK_TO_ADMIN_BUTTON])
+    return "📋 Broadcast Jobs\n\n" + "\n\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+@lru_cache(maxsize=64)
+def start_markup(has_pricing, backup_link):
+    keyboard = []
+    if has_pricing:
+        keyboard.append([InlineKeyboardButton("🤖 Get Bot Clone", callback_data="show_pricing")])
+    else:
+        keyboard.append([InlineKeyboardButton("🤖 Get Bot Clone", callback_data="get_clone")])
+    if backup_link:
+        keyboard.append([InlineKeyboardButton("📥 Backup Channel", url=backup_link)])
+    keyboard.append([InlineKeyboardButton("ℹ️ Help", callback_data="help")])
+    return InlineKeyboardMarkup(keyboard)
+
+@lru_cache(maxsize=64)
+def _welcome_footer(owner_name, owner_id):
+    return f"!\n\nThis bot is created by [{owner_name}](tg://user?id={owner_id})\n\nChoose an option below:"
+
+def welcome_text(first_name, owner_name, owner_id):
+    return "👋 Welcome " + first_name + _welcome_footer(owner_name, owner_id)
+
+def _page_markup(listing, page, rows=()):
+    keyboard = list(rows)
+    nav_row = []
+    if page['has_prev']:
+        nav_row.append(InlineKeyboardButton("◀️ Prev", callback_data=f"page:{listing}:prev:{page['first_id']}"))
+    if page['has_next']:
+        nav_row.append(InlineKeyboardButton("Next ▶️", callback_data=f"page:{listing}:next:{page['last_id']}"))
+    if nav_row:
+        keyboard.append(nav_row)
+    keyboard.append([BACK_TO_ADMIN_BUTTON])
+    return InlineKeyboardMarkup(keyboard)
+
+def auth_keys_page_view(page):
+    if not page['items'] and not page['has_prev']:
+        return "📋 No auth keys generated yet.", BACK_TO_ADMIN_MARKUP
+    parts = ["📋 **All Auth Keys:**\n"]
+    for key in page['items']:
+        status = "✅ Used" if key.get('is_used') else "⏳ Unused"
+        parts.append(
+            f"🔑 `{key['auth_key']}`\n"
+            f"👤 Purchaser: {key['purchaser_name']} (ID: {key['purchaser_id']})\n"
+            f"📅 Created: {key['created_at'].strftime('%Y-%m-%d %H:%M')}\n"
+            f"Status: {status}\n"
+        )
+    return "\n".join(parts), _page_markup("keys", page)
+
+def cloners_page_view(page):
+    if not page['items'] and not page['has_prev']:
+        return "👥 No one has cloned the bot yet.", BACK_TO_ADMIN_MARKUP
+    parts = ["👥 **People who cloned the bot:**\n"]
+    for cloner in page['items']:
+        parts.append(
+            f"👤 {cloner['purchaser_name']} (ID: {cloner['purchaser_id']})\n"
+            f"📅 Cloned: {cloner['used_at'].strftime('%Y-%m-%d %H:%M')}\n"
+            f"🔑 Key: `{cloner['auth_key']}`\n"
+        )
+    return "\n".join(parts), _page_markup("cloners", page)
+
+def banned_users_page_view(page):
+    if not page['items'] and not page['has_prev']:
+        return "✅ No banned users.", BACK_TO_ADMIN_MARKUP
+    rows = [
+        [InlineKeyboardButton(f"✅ Unban {user.get('first_name', 'Unknown')} ({user['user_id']})", callback_data=f"unban_{user['user_id']}")]
+        for user in page['items']
+    ]
+    return "🚫 **Banned Users:**\n\nSelect a user to unban:\n\n", _page_markup("banned", page, rows)
+
+@lru_cache(maxsize=16)
+def pricing_view(pricing):
+    text = f"💰 **Pricing Details**\n\n{pricing}\n\nClick below to contact admin:"
+    markup = InlineKeyboardMarkup([[InlineKeyboardButton("💳 Contact Admin to Purchase", callback_data="get_clone")]])
+    return text, markup
+
+@lru_cache(maxsize=64)
+def clone_contact_view(owner_id, owner_name):
+    if owner_id == ORIGINAL_BOT_CREATOR_ID:
+        text = f"🤖 **Want to clone this bot?**\n\nContact me to get your own bot clone!\n\n👤 Original Creator: [{ORIGINAL_BOT_CREATOR_NAME}](tg://user?id={ORIGINAL_BOT_CREATOR_ID})\n\nClick the button below to contact:"
+        keyboard = [[InlineKeyboardButton(f"💬 Contact {ORIGINAL_BOT_CREATOR_NAME}", url=f"tg://user?id={ORIGINAL_BOT_CREATOR_ID}")]]
+    else:
+        text = f"🤖 **Want to clone this bot?**\n\nContact the bot owner to get your own clone!\n\n👤 Bot Owner: [{owner_name}](tg://user?id={owner_id})\n\n💡 Want a bot like the original? Contact [{ORIGINAL_BOT_CREATOR_NAME}](tg://user?id={ORIGINAL_BOT_CREATOR_ID})\n\nClick the buttons below:"
+        keyboard = [
+            [InlineKeyboardButton(f"💬 Contact {owner_name}", url=f"tg://user?id={owner_id}")],
+            [InlineKeyboardButton(f"🌟 Get Original Bot by {ORIGINAL_BOT_CREATOR_NAME}", url=f"tg://user?id={ORIGINAL_BOT_CREATOR_ID}")]
+        ]
+    return text, InlineKeyboardMarkup(keyboard)
+"""
+
+# 14. metrics.py content
+metrics_py = r"""import os
+import asyncio
+import bisect
+import functools
+import logging
+import time
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9090'))
+METRICS_LISTEN = os.environ.get('METRICS_LISTEN', '127.0.0.1')
+LOOP_LAG_INTERVAL = float(os.environ.get('LOOP_LAG_INTERVAL', '0.5'))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name + _format_labels(self.label_names, key), value
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, label_names=(), function=None):
+        super().__init__(name, documentation, label_names)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        self.values[key] = value
+
+    def samples(self):
+        if self.function is not None:
+            yield self.name, self.function()
+        else:
+            yield from super().samples()
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        series = self.series.get(key)
+        if series is None:
+            # Per-bucket counts (made cumulative on render), then sum.
+            series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for key, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                yield self.name + "_bucket" + _format_labels(self.label_names, key, [("le", bound)]), cumulative
+            yield self.name + "_sum" + _format_labels(self.label_names, key), series[-1]
+            yield self.name + "_count" + _format_labels(self.label_names, key), cumulative
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for sample, value in metric.samples():
+            lines.append(f"{sample} {value}")
+    return "\n".join(lines) + "\n"
+
+HANDLER_LATENCY = Histogram("bot_handler_seconds", "Time spent handling an update", ("handler", "route"))
+DB_LATENCY = Histogram("bot_db_operation_seconds", "MongoDB call latency including executor queueing", ("operation",))
+BROADCAST_MESSAGES = Counter("bot_broadcast_messages_total", "Broadcast send attempts by outcome", ("result",))
+THROTTLED_UPDATES = Counter("bot_throttled_updates_total", "Updates dropped by flood control before any handler ran", ("reason",))
+STARTUP_SECONDS = Gauge("bot_startup_seconds", "Time spent starting up, by phase", ("phase",))
+LOOP_LAG = Histogram("bot_event_loop_lag_seconds", "Delay between a scheduled wakeup and when the loop ran it",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+def instrument_handler(name, callback, route=None):
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name, route=route(update) if route else "")
+    return wrapper
+
+async def monitor_loop_lag(interval=LOOP_LAG_INTERVAL):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, time.perf_counter() - started - interval))
+
+async def start_metrics_server(listen=METRICS_LISTEN, port=METRICS_PORT):
+    async def handle_metrics(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    web_app = web.Application()
+    web_app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    await web.TCPSite(runner, listen, port).start()
+    logger.info("Metrics served on http://%s:%d/metrics", listen, port)
+    return runner
+"""
+
+# 15. clone_host.py content
+clone_host_py = r"""import os
+import asyncio
+import logging
+import signal
+from telegram import Update
+from telegram.error import Forbidden, InvalidToken
+import database
+from async_database import run_sync, user_flush_loop, banned_ids_refresh_loop, flush_user_data, list_active_tenants, deactivate_tenant
+from broadcast_jobs import start_broadcast_worker, stop_broadcast_worker
+
+logger = logging.getLogger(__name__)
+
+TENANT_SYNC_INTERVAL = float(os.environ.get('TENANT_SYNC_INTERVAL', '10'))
+
+class CloneHost:
+    # Runs every active clone from the tenants collection as its own Application
+    # on this event loop, all sharing one MongoClient and one DB thread pool.
+    def __init__(self, build_application, make_builder):
+        self.build_application = build_application
+        self.make_builder = make_builder
+        self.tenants = {}
+        self.sync_requested = asyncio.Event()
+
+    def request_sync(self):
+        self.sync_requested.set()
+
+    async def add(self, name, bot_token, owner_id):
+        tenant = database.Tenant(name, owner_id)
+        application = self.build_application(self.make_builder(bot_token))
+        # Tasks copy the context they are created in, so everything the
+        # application spawns from here on runs against this tenant.
+        context_token = database.use_tenant(tenant)
+        try:
+            await run_sync(database.init_database)
+            await application.initialize()
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            await application.start()
+            flush_task = asyncio.create_task(user_flush_loop())
+            ban_refresh_task = asyncio.create_task(banned_ids_refresh_loop())
+            broadcast_task = start_broadcast_worker(application)
+        except BaseException:
+            if application.updater.running:
+                await application.updater.stop()
+            await application.shutdown()
+            raise
+        finally:
+            database.reset_tenant(context_token)
+        self.tenants[name] = (tenant, application, bot_token, (flush_task, ban_refresh_task, broadcast_task))
+        logger.info("Started clone %s for owner %s", name, owner_id)
+
+    async def remove(self, name):
+        tenant, application, _, (flush_task, ban_refresh_task, broadcast_task) = self.tenants.pop(name)
+        context_token = database.use_tenant(tenant)
+        try:
+            await stop_broadcast_worker(broadcast_task)
+            flush_task.cancel()
+            ban_refresh_task.cancel()
+            if application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
+            await flush_user_data()
+            await application.shutdown()
+        finally:
+            database.reset_tenant(context_token)
+        logger.info("Stopped clone %s", name)
+
+    async def sync(self):
+        wanted = {tenant["_id"]: tenant for tenant in await list_active_tenants()}
+        for name, (running, _, bot_token, _) in list(self.tenants.items()):
+            if name not in wanted or wanted[name]["bot_token"] != bot_token or wanted[name]["owner_id"] != running.owner_id:
+                await self.remove(name)
+        for name, tenant in wanted.items():
+            if name in self.tenants:
+                continue
+            # Only a token Telegram rejects is final; network errors, flood
+            # waits or a Mongo hiccup are retried on the next sync, and one
+            # failing clone must not keep the rest from starting.
+            try:
+                await self.add(name, tenant["bot_token"], tenant["owner_id"])
+            except (InvalidToken, Forbidden) as e:
+                logger.warning("Could not start clone %s: %s", name, e)
+                await deactivate_tenant(name, str(e))
+            except Exception:
+                logger.exception("Could not start clone %s, retrying on the next sync", name)
+
+    async def run(self, stop_event):
+        while not stop_event.is_set():
+            self.sync_requested.clear()
+            try:
+                await self.sync()
+            except Exception:
+                logger.exception("Clone sync failed")
+            waiters = [asyncio.create_task(stop_event.wait()), asyncio.create_task(self.sync_requested.wait())]
+            await asyncio.wait(waiters, timeout=TENANT_SYNC_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in waiters:
+                waiter.cancel()
+        for name in list(self.tenants):
+            await self.remove(name)
+
+async def serve_clone_host(application, build_application, make_builder, drop_pending_updates=False):
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    clone_host = CloneHost(build_application, make_builder)
+    application.bot_data['clone_host'] = clone_host
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=drop_pending_updates)
+        await application.start()
+        await clone_host.run(stop_event)
+        await application.updater.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+"""
+
+# 16. broadcast_jobs.py content
+broadcast_jobs_py = r"""import os
+import asyncio
+import logging
+from collections import deque
+from broadcast import Broadcast
+from async_database import claim_broadcast_job, checkpoint_broadcast_job, iter_recipients
+from render import broadcast_controls_markup, broadcast_job_view
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_CHECKPOINT_INTERVAL = float(os.environ.get('BROADCAST_CHECKPOINT_INTERVAL', '2'))
+BROADCAST_POLL_INTERVAL = float(os.environ.get('BROADCAST_POLL_INTERVAL', '5'))
+
+class BroadcastJobRunner:
+    # Sends one persisted job. Recipients stream in _id order and the cursor only
+    # moves past a user once everyone before them has an outcome, so a resume
+    # re-sends at most the messages that were in flight.
+    def __init__(self, bot, job):
+        self.job = job
+        self.cursor = job.get("cursor")
+        self.in_flight = deque()
+        self.results = {}
+        self.outcomes = []
+        self.broadcast = Broadcast(
+            bot,
+            job["text"],
+            self._recipients(),
+            progress_chat_id=job.get("progress_chat_id"),
+            progress_message_id=job.get("progress_message_id"),
+            progress_markup=broadcast_controls_markup(job["_id"], "running"),
+            on_result=self._on_result
+        )
+        self.broadcast.sent = job["sent"]
+        self.broadcast.failed = job["failed"]
+        self.broadcast.blocked = job["blocked"]
+
+    async def _recipients(self):
+        async for document_id, user_id in iter_recipients(after_id=self.cursor):
+            self.in_flight.append((user_id, document_id))
+            yield user_id
+
+    def _on_result(self, user_id, result):
+        self.results[user_id] = result
+        while self.in_flight and self.in_flight[0][0] in self.results:
+            finished_id, self.cursor = self.in_flight.popleft()
+            self.outcomes.append((finished_id, self.results.pop(finished_id)))
+
+    async def checkpoint(self, status="running"):
+        outcomes, self.outcomes = self.outcomes, []
+        try:
+            self.job = await checkpoint_broadcast_job(self.job["_id"], self.cursor, outcomes, status)
+        except Exception:
+            self.outcomes = outcomes + self.outcomes
+            raise
+        return self.job
+
+    async def _checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(BROADCAST_CHECKPOINT_INTERVAL)
+            try:
+                job = await self.checkpoint()
+            except Exception:
+                logger.exception("Broadcast checkpoint failed")
+                continue
+            if job["status"] != "running":
+                self.broadcast.stop()
+
+    async def run(self):
+        checkpoints = asyncio.create_task(self._checkpoint_loop())
+        try:
+            await self.broadcast.run()
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back so the next start resumes it at once.
+            checkpoints.cancel()
+            await self.checkpoint("queued")
+            raise
+        finally:
+            checkpoints.cancel()
+        job = await self.checkpoint("running" if self.broadcast.stopped else "done")
+        if self.broadcast.stopped:
+            text, reply_markup = broadcast_job_view(job)
+            await self.broadcast.edit_progress(text, reply_markup)
+        return job
+
+async def broadcast_worker_loop(bot, wakeup):
+    while True:
+        wakeup.clear()
+        try:
+            job = await claim_broadcast_job()
+        except Exception:
+            logger.exception("Could not claim a broadcast job")
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(wakeup.wait(), BROADCAST_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        logger.info("Running broadcast job %s from cursor %s", job["_id"], job.get("cursor"))
+        try:
+            await BroadcastJobRunner(bot, job).run()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Broadcast job %s failed", job["_id"])
+
+def start_broadcast_worker(application):
+    wakeup = application.bot_data['broadcast_wakeup'] = asyncio.Event()
+    return asyncio.create_task(broadcast_worker_loop(application.bot, wakeup))
+
+async def stop_broadcast_worker(task):
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+"""
+
+# 17. flood_control.py content
+flood_control_py = r"""import os
+import time
+from collections import OrderedDict
+import async_database
+
+FLOOD_RATE = float(os.environ.get('FLOOD_RATE', '1'))
+FLOOD_BURST = float(os.environ.get('FLOOD_BURST', '5'))
+FLOOD_MAX_USERS = int(os.environ.get('FLOOD_MAX_USERS', '10000'))
+CALLBACK_DEDUPE_WINDOW = float(os.environ.get('CALLBACK_DEDUPE_WINDOW', '1'))
+
+class FloodControl:
+    # A token bucket per (tenant, user): FLOOD_BURST updates at once, then
+    # FLOOD_RATE per second. Both dicts are LRUs capped at max_users, so a flood
+    # of distinct ids costs bounded memory; an evicted user just starts again
+    # with a full bucket.
+    def __init__(self, rate=FLOOD_RATE, burst=FLOOD_BURST, max_users=FLOOD_MAX_USERS, dedupe_window=CALLBACK_DEDUPE_WINDOW):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.dedupe_window = dedupe_window
+        self.buckets = OrderedDict()
+        self.recent_taps = OrderedDict()
+
+    def _remember(self, entries, key, value):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_users:
+            entries.popitem(last=False)
+
+    def allow(self, user_id, now=None):
+        if self.rate <= 0:
+            return True
+        now = time.monotonic() if now is None else now
+        key = (async_database.current_tenant().name, user_id)
+        tokens, updated_at = self.buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        allowed = tokens >= 1
+        self._remember(self.buckets, key, (tokens - 1 if allowed else tokens, now))
+        return allowed
+
+    # Taps on the same button of the same message within the window are one
+    # request: the first goes through and the rest are coalesced into it.
+    def is_repeat_tap(self, user_id, message_key, data, now=None):
+        if self.dedupe_window <= 0:
+            return False
+        now = time.monotonic() if now is None else now
+        key = (async_database.current_tenant().name, user_id, message_key, data)
+        tapped_at = self.recent_taps.get(key)
+        if tapped_at is not None and now - tapped_at < self.dedupe_window:
+            return True
+        self._remember(self.recent_taps, key, now)
+        return False
+"""
+
+# 18. requirements-dev.txt content
+requirements_dev_txt = """-r requirements.txt
+mongomock==4.3.0"""
+
 # File creation logic
 files = {
     "main.py": main_py,
     "database.py": database_py,
     "handlers.py": handlers_py,
     "requirements.txt": requirements_txt,
+    "requirements-dev.txt": requirements_dev_txt,
     ".env.example": env_example,
     "Dockerfile": dockerfile,
-    "README.md": readme_md
+    "README.md": readme_md,
+    "broadcast.py": broadcast_py,
+    "benchmarks.py": benchmarks_py,
+    "async_database.py": async_database_py,
+    "webhook.py": webhook_py,
+    "state_store.py": state_store_py,
+    "render.py": render_py,
+    "metrics.py": metrics_py,
+    "clone_host.py": clone_host_py,
+    "broadcast_jobs.py": broadcast_jobs_py,
+    "flood_control.py": flood_control_py
 }
 
 for filename, content in files.items():